@@ -17,6 +17,7 @@ import sys
 from cli.cli import param_parser
 import secrets.handler as sm
 import web3signer.handler as w3s
+import verify.handler as vfy
 
 if __name__ == "__main__":
 
@@ -33,3 +34,5 @@ if __name__ == "__main__":
         sm.handler(command_flags, subcommand, subcommand_flags)
     elif command == "web3signer":
         w3s.handler(command_flags, subcommand, subcommand_flags)
+    elif command == "verify":
+        vfy.handler(command_flags, subcommand, subcommand_flags)
@@ -0,0 +1 @@
+"""Keystore package shared by the tool commands"""
\ No newline at end of file
@@ -0,0 +1,24 @@
+"""Key index ranges of EIP2334 keystores"""
+
+def group_indexes(indexes: list) -> list:
+    """Groups sorted key indexes into a list of (low, high) ranges of consecutive indexes"""
+    ranges = []
+    for index in indexes:
+        if ranges and ranges[-1][1] == index - 1:
+            ranges[-1] = (ranges[-1][0], index)
+        else:
+            ranges.append((index, index))
+    return ranges
+
+def format_ranges(ranges: list, flag_value: bool = False) -> str:
+    """
+    Formats a list of (low, high) ranges.
+
+    Args:
+        ranges: List of (low, high) key index ranges, as from group_indexes.
+        flag_value: Format them as a 'secrets get --index-range' value, as in '5,900_950'.
+            Otherwise formats them for printing, as in 'indexes 5, 900 to 950'.
+    """
+    if flag_value:
+        return ",".join(str(low) if low == high else f"{low}_{high}" for low, high in ranges)
+    return "indexes " + ", ".join(str(low) if low == high else f"{low} to {high}" for low, high in ranges)
@@ -0,0 +1,37 @@
+"""Scanner for directories of EIP2334 compliant keystore files"""
+
+import os
+import re
+import collections
+
+#? Matches keystore-m_12381_3600_i_0_0-timestamp.json, capturing i and the timestamp.
+#? https://eips.ethereum.org/EIPS/eip-2334
+#? https://github.com/ethereum/staking-deposit-cli/blob/master/staking_deposit/credentials.py#L155
+KEYSTORE_FILE_PATTERN = re.compile(r"^keystore-m_12381_3600_(\d+)_0_0-(\d+)\.json$")
+
+# Compact record of a keystore file, parsed once from its name
+#? index: i in m/12381/3600/i/0/0. timestamp: the unix timestamp str in the file name.
+#? path: the full path to the file.
+KeystoreFile = collections.namedtuple("KeystoreFile", ["index", "timestamp", "path"])
+
+def scan_keystores(key_directory_path: str) -> list:
+    """
+    Scans key_directory_path with os.scandir and returns a KeystoreFile for every file that
+    matches the keystore-m_12381_3600_*_0_0-*.json format, in key index order.
+    File names are parsed only once, and no file is opened nor stat'ed.
+
+    Args:
+        key_directory_path: Path to the directory containing the keystores.
+
+    Returns: A list of KeystoreFile records sorted by key index.
+    """
+    # Parse every matching entry into a record
+    records = []
+    with os.scandir(key_directory_path) as entries:
+        for entry in entries:
+            match = KEYSTORE_FILE_PATTERN.match(entry.name)
+            if match and entry.is_file():
+                records.append(KeystoreFile(int(match.group(1)), match.group(2), entry.path))
+
+    #? Records compare as tuples, so repeated indexes are ordered by timestamp.
+    return sorted(records)
@@ -0,0 +1 @@
+"""Audit module for secrets package"""
\ No newline at end of file
@@ -0,0 +1,145 @@
+"""Compares the keystores in the key directory with their secrets, without reading any payload"""
+import re
+import hashlib
+
+import secrets.utilities as util
+import secrets.upload.utilities as upload_util
+import keystores.indexes as indexes
+
+from google.cloud import secretmanager
+from cli.pretty.colors import green, end, red, yellow, bold
+
+def audit_secrets(project_id: str, key_directory_path: str, concurrency: int = 1) -> bool:
+    """
+    Audits the keystores in key_directory_path against their single and fat secrets.
+    Remote hashes come from the secret annotations of a single list_secrets pass, and local
+    hashes are computed the way 'upload' builds the payloads, so no secret is read.
+        - single secrets store the SHA256 of their keystore.
+        - fat secrets store the SHA256 of their decoded payload, the <index>:<timestamp>:<keystore>
+          lines of their keys, which is rebuilt from the keystores in their index range.
+
+    Args:
+        project_id: Google cloud project ID where the secrets live
+        key_directory_path: Path to keystore files
+        concurrency: Number of keystores read and hashed in parallel. 1 runs serially.
+
+    Returns: True if every secret matches the key directory, False otherwise
+    """
+    # Get filenames and client
+    client = util.create_sm_client()
+    files = upload_util.get_keyfiles(key_directory_path)
+
+    # Get the remote hashes
+    single_hashes, fat_secrets = get_remote_hashes(client, project_id)
+    print(f"[INFO] Found {len(single_hashes)} single and {len(fat_secrets)} fat secrets in Google Cloud Secret Manager.")
+
+    # Hash the local keystores and the fat payloads they belong to
+    print(f"\n[INFO] Hashing {len(files)} local keystores with {concurrency} worker(s)...")
+    fat_hashers = {secret_name: hashlib.sha256() for _, _, secret_name, _ in fat_secrets}
+    fat_key_counts = dict.fromkeys(fat_hashers, 0)
+    active_fat_secrets = []
+    next_fat_secret = 0
+
+    local_names = set()
+    matched, mismatched, unverified, missing = [], [], [], []
+    for key_file, payload_sha256, line in util.map_concurrently(hash_keystore, files, concurrency):
+        in_remote = False
+
+        # Compare with the single secret
+        secret_name = upload_util.get_secret_name(key_file)
+        local_names.add(secret_name)
+        if secret_name in single_hashes:
+            in_remote = True
+            if single_hashes[secret_name] is None:
+                unverified.append(secret_name)
+            elif single_hashes[secret_name] == payload_sha256:
+                matched.append(secret_name)
+            else:
+                mismatched.append(secret_name)
+
+        # Add the line to the payload of every fat secret holding the key index
+        #? Keystores come in index order, so the fat secrets covering the index are tracked
+        #? with a sliding window over the secrets sorted by low index.
+        while next_fat_secret < len(fat_secrets) and fat_secrets[next_fat_secret][0] <= key_file.index:
+            active_fat_secrets.append(fat_secrets[next_fat_secret])
+            next_fat_secret += 1
+        active_fat_secrets = [secret for secret in active_fat_secrets if secret[1] >= key_file.index]
+        for _, _, fat_name, _ in active_fat_secrets:
+            in_remote = True
+            fat_hashers[fat_name].update(line)
+            fat_key_counts[fat_name] += 1
+
+        if not in_remote:
+            missing.append(key_file.index)
+
+    # Compare with the fat secrets
+    extra = sorted(name for name in single_hashes if name not in local_names)
+    for _, _, fat_name, remote_hash in fat_secrets:
+        if not fat_key_counts[fat_name]:
+            extra.append(fat_name)
+        elif remote_hash is None:
+            unverified.append(fat_name)
+        elif fat_hashers[fat_name].hexdigest() == remote_hash:
+            matched.append(fat_name)
+        else:
+            mismatched.append(fat_name)
+
+    # Report
+    print(f"\t[{green}✓{end}] {len(matched)} secrets match the key directory.")
+    if unverified:
+        print(f"\t[{yellow}-{end}] {bold}{len(unverified)}{end} secrets have no stored hash and can't be audited.",
+              "Upload them again, or run 'secrets sync' for single secrets, to store it:", *[f"\n\t\t{name}" for name in unverified])
+    if mismatched:
+        print(f"\t[{red}x{end}] {bold}{len(mismatched)}{end} secrets don't match their keystores:",
+              *[f"\n\t\t{name}" for name in mismatched])
+    if missing:
+        print(f"\t[{red}x{end}] {bold}{len(missing)}{end} keys are in no secret: {indexes.format_ranges(indexes.group_indexes(missing))}")
+    if extra:
+        print(f"\t[{red}x{end}] {bold}{len(extra)}{end} secrets hold no key of the key directory:",
+              *[f"\n\t\t{name}" for name in extra])
+
+    return not (mismatched or missing or extra)
+
+def get_remote_hashes(client: secretmanager.SecretManagerServiceClient, project_id: str) -> tuple:
+    """
+    Lists all the single and fat secrets in the project along with their stored hash.
+
+    Returns: A tuple
+        - dict: single secret name to the SHA256 hex of its keystore, or None if not annotated.
+        - list: tuples (int:low, int:high, str:secret_name, str:SHA256 hex of the decoded
+            payload or None) of the fat secrets, sorted by low index.
+    """
+    single_hashes = {}
+    fat_secrets = []
+
+    #? The list response carries the annotations, so no secret is read.
+    raw_secrets = util.list_secrets(client, project_id, util.get_name_filter("keystore-m_", "key-index_"),
+                                    lambda secret: secret)
+    for secret in raw_secrets:
+        secret_name = secret.name.split("/")[-1]
+        remote_hash = secret.annotations.get(util.SHA256_ANNOTATION)
+        fat_match = re.match(util.FAT_SECRET_PATTERN, secret_name)
+        if re.match(util.SINGLE_SECRET_PATTERN, secret_name):
+            single_hashes[secret_name] = remote_hash
+        elif fat_match:
+            fat_secrets.append((int(fat_match.group(1)), int(fat_match.group(2)), secret_name, remote_hash))
+
+    return single_hashes, sorted(fat_secrets)
+
+def hash_keystore(key_file) -> tuple:
+    """
+    Reads a keystore the way 'upload' does.
+
+    Args:
+        key_file: A scanner.KeystoreFile record
+
+    Returns: A tuple of the key_file, the SHA256 hex of its single secret payload, and its
+        <index>:<timestamp>:<keystore> line of a fat payload as bytes.
+    """
+    with open(key_file.path, "r", encoding="utf-8") as f:
+        raw_contents = f.read()
+        f.close()
+
+    payload_bytes = raw_contents.encode("utf-8")
+    line = f"{key_file.index}:{key_file.timestamp}:{raw_contents}\n".encode("utf-8")
+    return key_file, hashlib.sha256(payload_bytes).hexdigest(), line
@@ -0,0 +1,38 @@
+"""Handler for the 'audit' subcommand of secrets command"""
+
+import sys
+
+import secrets.validation_logic as logic
+import secrets.audit.audit_secrets as auditor
+
+from cli.pretty.colors import green, end, red
+
+def handler(subcommand_flags: list, project_id: str, key_directory_path: str):
+    """
+    Handles audit subcommand logic.
+        1. Unpacks subcommand flags
+        2. Routes to audit execution
+        3. Exits with an error if the secrets don't match the key directory
+
+    Args:
+        - subcommand_flags: List of subcommand flags
+        - project_id: The Google Cloud Project ID holding the secrets
+        - key_directory_path: Path to the local keystore files
+    """
+    # Intialize flags
+    concurrency = 1
+
+    # Unpack subcommand flags
+    while subcommand_flags:
+        flag = subcommand_flags.pop()
+        if "--concurrency" in flag:
+            concurrency = logic.validate_concurrency("--concurrency", flag.split("=")[1])
+
+    # Route to audit execution
+    if not auditor.audit_secrets(project_id, key_directory_path, concurrency):
+        print(f"\n[{red}ERROR{end}] Audit failed. Secret Manager doesn't match the key directory.\n")
+        sys.exit(1)
+
+    print(f"\n[{green}SUCCESS{end}] Audit complete. Secret Manager matches the key directory.\n")
+
+    return
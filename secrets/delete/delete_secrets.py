@@ -1,31 +1,81 @@
 """Deletes all the secrets matching the provided pattern"""
+import functools
+
 import secrets.utilities as util
+import secrets.delete.utilities as de_util
+
+from google.api_core import exceptions
+from cli.pretty.colors import green, end, yellow, red, bold
 
-def delete_secrets(client: util.secretmanager.SecretManagerServiceClient, secrets: list, project_id: str):
+def delete_secrets(client: util.secretmanager.SecretManagerServiceClient, secrets: list, project_id: str,
+                   concurrency: int = 1, report = None) -> int:
     """
     Deletes all the provided secrets.
-    
+    Deletes are idempotent: secrets that no longer exist count as deleted, throttled and
+    unavailable calls are retried by util.call_secret_manager, and any other error is recorded
+    without stopping the remaining deletes.
+
     Args:
         client: the Secret Manager clietn
         secrets: the list of secrets names to be deleted.
         project_id: Google Cloud project id where to look for secrets.
-    
-    Returns: The number of secrets deleted
+        concurrency: Number of secrets deleted in parallel. 1 runs serially.
+        report: Optional delete report from de_util.open_delete_report, recording every result.
+
+    Returns: The number of secrets deleted, including the ones that were already gone
     """
 
-    print ("\n[INFO] Deleting secrets...")
-    i = 1
+    print (f"\n[INFO] Deleting {len(secrets)} secrets with {concurrency} worker(s)...")
+
+    results = util.map_concurrently(functools.partial(delete_secret, client, project_id, len(secrets)),
+                                    enumerate(secrets, start=1), concurrency)
+
+    # Count and record every result as it completes
+    #? Every delete is recorded as it comes back, so a crash loses at most the in flight deletes.
+    counts = {"deleted": 0, "not_found": 0, "failed": 0}
+    for entry in results:
+        counts[entry["status"]] += 1
+        if report:
+            de_util.append_to_report(report, entry)
+
+    if counts["not_found"]:
+        print(f"\n[{yellow}WARN{end}] {bold}{counts['not_found']}{end} secrets were already deleted.")
+    if counts["failed"]:
+        print(f"\n[{red}ERROR{end}] Failed to delete {bold}{counts['failed']}{end} secrets.")
+
+    return counts["deleted"] + counts["not_found"]
+
+def delete_secret(client: util.secretmanager.SecretManagerServiceClient, project_id: str,
+                  total: int, position_and_name: tuple) -> dict:
+    """
+    Deletes a single secret.
+
+    Args:
+        client: the Secret Manager client
+        project_id: Google Cloud project id where to look for secrets.
+        total: Total number of secrets to delete, for logging purposes
+        position_and_name: Tuple of (position of the secret in the run, secret name)
+
+    Returns: The report entry of the secret. A dict with the secret_name, the status
+        'deleted', 'not_found' or 'failed', and the error of failed deletes.
+    """
+    i, secret = position_and_name
 
-    for secret in secrets:
+    # Set secret name
+    name = f"projects/{project_id}/secrets/{secret}"
 
-        print(f"\t[-] Deleting secret name: {secret} - {i}/{len(secrets)}")
+    # Delete
+    try:
+        util.call_secret_manager("write", client.delete_secret, {"name": name})
 
-        # Set secret name
-        name = f"projects/{project_id}/secrets/{secret}"
+    except exceptions.NotFound:
+        print(f"\t[{yellow}-{end}] Secret {secret} was already deleted - {i}/{total}")
+        return {"secret_name": secret, "status": "not_found", "error": None}
 
-        # Delete
-        client.delete_secret(request={"name": name})
+    except exceptions.GoogleAPICallError as error:
+        print(f"\t[{red}x{end}] Error deleting {secret}: {error.message} - {i}/{total}")
+        return {"secret_name": secret, "status": "failed", "error": error.message}
 
-        i += 1
+    print(f"\t[{green}✓{end}] Deleted secret {secret} - {i}/{total}")
 
-    return i-1
+    return {"secret_name": secret, "status": "deleted", "error": None}
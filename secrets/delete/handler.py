@@ -1,15 +1,17 @@
 """Handler for the 'delete' subcommand of secrets command"""
 
+import os
 import sys
 
 import secrets.utilities as util
+import secrets.validation_logic as logic
 import secrets.delete.utilities as de_util
 import secrets.delete.delete_secrets as del_executer
 
-from cli.pretty.colors import red, end, green
+from cli.pretty.colors import red, end, green, bold
 from cli.utilities import print_usage_string_for_command_and_flag
 
-def handler(subcommand_flags: list, project_id: str):
+def handler(subcommand_flags: list, project_id: str, output_dir: str):
     """
     Handles upload subcommand logic.
         1. Unpacks subcommand flags
@@ -20,12 +22,15 @@ def handler(subcommand_flags: list, project_id: str):
     Args:
         - subcommand_flags: List of subcommand flags
         - project_id: The Google Cloud Project ID to delete secrets from
+        - output_dir: Output directory defined in .env, where the delete report is written
         
     """
     # Define subcommand bool flags
     secret_name = ""
     pattern = ""
     skip_confirm = False
+    concurrency = 1
+    resume = False
     
     # Unpack and catch subcommand flags
     while subcommand_flags:
@@ -37,6 +42,10 @@ def handler(subcommand_flags: list, project_id: str):
             pattern = flag.split("=")[-1]
         elif "--skip-confirmation" in flag:
             skip_confirm = True
+        elif "--concurrency" in flag:
+            concurrency = logic.validate_concurrency("--concurrency", flag.split("=")[1])
+        elif "--resume" in flag:
+            resume = True
 
     # Alert and exist if no flag values are passed to delete
     if not secret_name and not pattern:
@@ -51,7 +60,7 @@ def handler(subcommand_flags: list, project_id: str):
     if secret_name:
         # Get confirmation then send to executer
         de_util.confirm_delete(skip_confirm, "name", secret_name) # This will exit if confirmation is not succesful
-        deleted_secrets = del_executer.delete_secrets(client, [secret_name], project_id)
+        secrets_to_delete = [secret_name]
 
     else:
         # Find pattern
@@ -59,12 +68,28 @@ def handler(subcommand_flags: list, project_id: str):
 
         # Get confirmation
         de_util.confirm_delete(skip_confirm, "pattern", deletion_pattern)
-        matching_secrets = util.get_secret_names_matching_pattern(client, project_id, deletion_pattern)
+        #? The names are collected before deleting, as deleting while paging could skip secrets.
+        secrets_to_delete = list(util.get_secret_names_matching_pattern(client, project_id, deletion_pattern))
 
-        # Send to executer
-        deleted_secrets = del_executer.delete_secrets(client, matching_secrets, project_id)
+    # Open the delete report and skip the secrets a resumed run already deleted
+    report, done = de_util.open_delete_report(output_dir, resume)
+    if done:
+        print(f"[INFO] Resuming. Skipping {bold}{len(done)}{end} secrets already deleted.")
+        secrets_to_delete = [name for name in secrets_to_delete if name not in done]
 
+    # Send to executer
+    deleted_secrets = del_executer.delete_secrets(client, secrets_to_delete, project_id,
+                                                  concurrency, report)
+    report.close()
 
-    print(f"\n[{green}SUCCESS{end}] Succesfully deleted {deleted_secrets} secrets.\n")
+    # Point to the report if any delete failed
+    report_path = os.path.join(output_dir, "delete_report.jsonl")
+    if deleted_secrets < len(secrets_to_delete):
+        print(f"\n[{red}ERROR{end}] Deleted {deleted_secrets} of {len(secrets_to_delete)} secrets.",
+              f"See {report_path} and pass '--resume' to retry the failed ones.\n")
+        sys.exit(1)
+
+    print(f"\n[{green}SUCCESS{end}] Succesfully deleted {deleted_secrets} secrets.",
+          f"Report written to {report_path}.\n")
 
     return
@@ -1,20 +1,31 @@
-"""Utilities for the get subcommand on secrets command"""
+"""Utilities for the delete subcommand on secrets command"""
 
+import os
 import sys
 
+import secrets.utilities as util
+
 from cli.pretty.colors import yellow, end, bold, red
 
+# Secrets whose report status is one of these are not deleted again on resume
+#? 'not_found' secrets were already gone, by a previous run or another deleter.
+DELETE_DONE_STATUSES = ("deleted", "not_found")
+
 def confirm_delete(authorize: bool, delete_mode:str, name_or_pattern: str):
     """
     Prompts the user for confirmation if the authorize confirmation is not passed.
     
     Args:
         authorize: Boolean indicating whether to prompt for confirmation or not.
-        delete_mode: 'name' or 'pattern'.
-        name_or_pattern: The name of the secret to be deleted or the pattern for deletion.
+        delete_mode: 'name', 'pattern' or 'list'.
+        name_or_pattern: The name of the secret to be deleted, the pattern for deletion or
+            the list of secret names to be deleted.
     """
     if delete_mode == "name":
         message = f"the secret {name_or_pattern}. This action is {red}{bold}irreversible{end}."
+    elif delete_mode == "list":
+        names = "\n\t\t".join(name_or_pattern)
+        message = f"{len(name_or_pattern)} secrets:\n\t\t{names}\n\tThis action is {red}{bold}irreversible{end}."
     else:
         message = f"all secrets matching the pattern {name_or_pattern}. This can mean multiple secrets deleted. This is action is {red}{bold}irreversible{end}."
 
@@ -28,3 +39,33 @@ def confirm_delete(authorize: bool, delete_mode:str, name_or_pattern: str):
 
     print()
     return
+
+def open_delete_report(output_dir: str, resume: bool) -> tuple:
+    """
+    Opens the delete report in output_dir. Every secret gets a line with its deletion status
+    as soon as its delete completes, so an interrupted delete can be resumed.
+    When resuming, the entries of the previous run are read back and a truncated last line left
+    by a crash is dropped. Otherwise the report starts empty.
+
+    Args:
+        output_dir: Chosen output directory in the config.
+        resume: Whether to keep the entries of a previous run.
+
+    Returns: A tuple file:report opened for appending, set:names of the secrets already deleted
+    """
+    report_path = os.path.join(output_dir, "delete_report.jsonl")
+    report, entries = util.open_record_file(report_path, resume, "report")
+
+    done = {entry["secret_name"] for entry in entries if entry["status"] in DELETE_DONE_STATUSES}
+
+    return report, done
+
+def append_to_report(report, entry: dict):
+    """
+    Appends the result of a delete to the delete report and syncs it to disk right away.
+
+    Args:
+        report: The report file from open_delete_report
+        entry: Dict with the secret_name, status and error of the delete.
+    """
+    util.append_record(report, entry)
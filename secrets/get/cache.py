@@ -0,0 +1,165 @@
+"""Local encrypted cache of the fat secrets fetched by the get subcommand"""
+
+import os
+import sys
+import threading
+import collections
+
+import secrets.utilities as util
+
+from google.api_core import exceptions
+from cryptography.fernet import Fernet, InvalidToken
+from cli.pretty.colors import red, yellow, end
+
+# Cache settings
+#? The directory lives in the output directory, next to imported_validator_keys.
+CACHE_DIRECTORY_NAME = ".fat_secret_cache"
+CACHE_KEY_VARIABLE = "CACHE_KEY"
+
+#? Cache entries are files named <project>/<secret_name>.<version>, so projects sharing an output
+#? directory never read each other's entries. An entry holds the full version name, a newline and
+#? the payload as returned by Secret Manager, so zlib fat secrets stay compressed, all encrypted
+#? with Fernet (AES-128-CBC with an HMAC-SHA256). The version name is checked on every read.
+#? The file modification time tracks the last use for the LRU eviction.
+FatCache = collections.namedtuple("FatCache", ["directory", "fernet", "max_bytes"])
+
+_cache_lock = threading.Lock()
+
+def open_cache(output_dir: str, max_megabytes: int) -> FatCache:
+    """
+    Opens the cache directory in output_dir, creating it if needed, with the key in the
+    CACHE_KEY variable of the .env file. Exits if the key is missing or invalid.
+
+    Args:
+        output_dir: Output directory defined in .env
+        max_megabytes: Size limit of the cache. The least recently used entries are evicted above it.
+
+    Returns: A FatCache to pass to the cached reads.
+    """
+    key = os.getenv(CACHE_KEY_VARIABLE)
+    if not key:
+        print(f"\n[{red}ERROR{end}] No cache key found. Set {CACHE_KEY_VARIABLE} in the .env file.",
+              "\n\tGenerate one with: python3 -c 'from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())'")
+        sys.exit(1)
+
+    try:
+        fernet = Fernet(key)
+    except ValueError:
+        print(f"\n[{red}ERROR{end}] Invalid {CACHE_KEY_VARIABLE}. It must be a 32 byte url-safe base64 Fernet key.")
+        sys.exit(1)
+
+    # Create the directory readable by the owner only
+    directory = os.path.join(output_dir, CACHE_DIRECTORY_NAME)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    # Remove the entries of older releases, which weren't scoped to a project
+    for entry in os.scandir(directory):
+        if entry.is_file(follow_symlinks=False):
+            remove_entry(entry.path)
+
+    return FatCache(directory, fernet, max_megabytes * 1024 * 1024)
+
+def read_cached_secret(client: util.secretmanager.SecretManagerServiceClient, cache: FatCache,
+                       project_id: str, secret_name: str) -> tuple:
+    """
+    Cached counterpart of get_util.read_named_secret. Resolves the latest version number with a
+    metadata call, and only downloads the payload if that version isn't cached.
+
+    Returns: A tuple str:secret_name, str:payload, or an empty payload if the secret doesn't exist.
+    """
+    name = f"projects/{project_id}/secrets/{secret_name}/versions/latest"
+    try:
+        version = util.call_secret_manager("read", client.get_secret_version, {"name": name})
+        data = get_cached_payload(cache, version.name)
+        if data is None:
+            response = util.call_secret_manager("access", client.access_secret_version, {"name": version.name})
+            data = response.payload.data
+            put_cached_payload(cache, version.name, data)
+
+    except exceptions.NotFound:
+        return secret_name, ""
+
+    return secret_name, util.decode_payload(data)
+
+def get_cached_payload(cache: FatCache, version_name: str) -> bytes:
+    """
+    Returns the cached payload of a secret version and marks it as recently used, or None if the
+    version isn't cached. Entries that fail to decrypt, for example after a key change, or that
+    hold another version than the requested one are dropped.
+    """
+    path = get_entry_path(cache, version_name)
+    try:
+        with open(path, "rb") as f:
+            token = f.read()
+            f.close()
+        stored_name, _, data = cache.fernet.decrypt(token).partition(b"\n")
+
+    except FileNotFoundError:
+        return None
+
+    except InvalidToken:
+        print(f"\t[{yellow}-{end}] Dropping unreadable cache entry for {version_name}.")
+        remove_entry(path)
+        return None
+
+    if stored_name.decode("utf-8", errors="replace") != version_name:
+        print(f"\t[{yellow}-{end}] Dropping cache entry of another version for {version_name}.")
+        remove_entry(path)
+        return None
+
+    os.utime(path)
+    return data
+
+def put_cached_payload(cache: FatCache, version_name: str, data: bytes):
+    """
+    Encrypts and stores the payload of a secret version, removes the older versions of the
+    secret, and evicts the least recently used entries if the cache is over its size limit.
+    """
+    path = get_entry_path(cache, version_name)
+    project_directory, entry_name = os.path.split(path)
+    secret_name = entry_name.rsplit(".", 1)[0]
+    os.makedirs(project_directory, mode=0o700, exist_ok=True)
+
+    # Write the entry atomically
+    #? A reader never sees a partially written entry, even with concurrent fetches.
+    with open(f"{path}.tmp", "wb") as f:
+        f.write(cache.fernet.encrypt(version_name.encode("utf-8") + b"\n" + data))
+        f.close()
+    os.chmod(f"{path}.tmp", 0o600)
+    os.replace(f"{path}.tmp", path)
+
+    with _cache_lock:
+        # Remove the superseded versions of the secret in the same project
+        for entry in os.scandir(project_directory):
+            if entry.name.startswith(f"{secret_name}.") and entry.path != path and not entry.name.endswith(".tmp"):
+                remove_entry(entry.path)
+
+        # Evict the least recently used entries of all projects
+        #? Entries still being written by other workers are left alone.
+        entries = sorted((entry for entry in list_entries(cache) if not entry.name.endswith(".tmp")),
+                         key=lambda entry: entry.stat().st_mtime)
+        total_bytes = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if total_bytes <= cache.max_bytes:
+                break
+            total_bytes -= entry.stat().st_size
+            remove_entry(entry.path)
+
+def get_entry_path(cache: FatCache, version_name: str) -> str:
+    """Returns the path of the cache entry of a secret version, named <project>/<secret_name>.<version>"""
+    #? The version name is projects/<project>/secrets/<secret>/versions/<version>
+    _, project, _, secret_name, _, version = version_name.split("/")
+    return os.path.join(cache.directory, project, f"{secret_name}.{version}")
+
+def list_entries(cache: FatCache):
+    """Yields the os.DirEntry of every cache entry, in the project directories of the cache"""
+    for project_entry in os.scandir(cache.directory):
+        if project_entry.is_dir(follow_symlinks=False):
+            yield from os.scandir(project_entry.path)
+
+def remove_entry(path: str):
+    """Removes a cache entry, ignoring entries already removed by another worker"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -2,81 +2,129 @@
 import os
 import re
 import sys
-import json
+import functools
 
 import secrets.utilities as util
 import secrets.get.utilities as get_util
 
+from google.api_core import exceptions
 from cli.pretty.colors import green, end, yellow, bold, blue, red
 from cli.utilities import print_usage_string_for_command_subcommand_and_flag
 
-def get_secrets_from_file(file_name: str, project_id: str, output_dir: str):
+# Names of the secrets that couldn't be fetched, in the same format as the input file
+RETRY_FILE_NAME = "get_retry_secret_names.txt"
+
+def get_secrets_from_file(file_name: str, project_id: str, output_dir: str,
+                          concurrency: int = 1, archive: str = ""):
     """
     Scans the provided file and fetches all the secrets contained in that file.
     It then creates the appropriate keystore for those keys.
+    Names are streamed from the file and every keystore is written as soon as it's fetched, so
+    memory stays flat regardless of the number of secrets.
+    Names that can't be fetched are written to a retry file in output_dir.
     Caller should pre-validate file_name.
     
     Args:
         file_name: A path to a .txt file containing the names of all the secrets to get.
         project_id: Google Cloud project id where to look for secrets.
         output_dir: Output directory defined in .env
+        concurrency: Number of secrets fetched in parallel. 1 runs serially.
+        archive: Optional tar archive path to write the keys to, see get_util.open_output.
     """
-    # Get secret manager client and set pattern
+    # Get secret manager client
     client = util.create_sm_client()
-    
-    # Open the file and read the contents
-    with open(file_name, "r", encoding="utf-8") as file:
-        secrets_to_read = file.readlines()
-        file.close()
-
-    print(f"\n[INFO] Found {yellow}{bold}{len(secrets_to_read)}{end} secret names in {blue}{file_name}{end}.")
-    counter = 1
-
-    #? This is a list of strings in the format <timestamp>:<secret>, where <secret>
-    #? is a JSON string
-    read_secrets = []
 
-    pattern = r'^keystore-m_12381_3600_\d+_0_0-\d+$'
-
-    print ("\n[INFO] Reading secrets...")
-    # Iterate through the secret names and read them
-    for secret_name in secrets_to_read:
-        # Get rid of the extra newline at the end
-        secret_name = secret_name.strip()
-
-        # Check that the secret name matches
-        if not re.match(pattern, secret_name):
+    # Check that the secret names match, counting them along the way
+    #? Checking every name before fetching keeps a bad file from leaving a partial import.
+    total = 0
+    for secret_name in read_secret_names(file_name):
+        if not re.match(util.SINGLE_SECRET_PATTERN, secret_name):
             print(f"\n[{red}ERROR{end}] Can only get secrets by name with 'keystore-m_12381_3600_*_0_0-*' secrets.",
                 "\n\tTo get secrets by index range run:",
                 f"\n\t{print_usage_string_for_command_subcommand_and_flag('secrets', 'get', '--index-range=<value>')}\n")
             sys.exit(1)
-
-        # Get secret and load it into a dictionary
-        raw_secret_string = get_util.read_secret(client, project_id, secret_name)
-        secret_payload = json.loads(raw_secret_string)
-
-        if not secret_payload or "path" not in secret_payload:
-            print(f"\t[{yellow}-{end}] Could not fetch secret {secret_name}.\n\tIngoring secret.")
+        total += 1
+
+    print(f"\n[INFO] Found {yellow}{bold}{total}{end} secret names in {blue}{file_name}{end}.")
+
+    # Create the output directory
+    keys_dir = os.path.join(output_dir, "imported_validator_keys")
+    output = get_util.open_output(keys_dir, archive)
+
+    print (f"\n[INFO] Reading and writing secrets to '{blue}{get_util.describe_output(keys_dir, archive)}'{end}",
+           f"with {concurrency} worker(s)...")
+
+    # Fetch the secrets
+    #? Results come back in file order regardless of the concurrency.
+    results = util.map_concurrently(functools.partial(fetch_secret, client, project_id),
+                                    read_secret_names(file_name), concurrency)
+
+    # Write every secret as it arrives
+    retry_file_path = os.path.join(output_dir, RETRY_FILE_NAME)
+    retry_file = None
+    written = 0
+    for secret_name, raw_secret_string in results:
+        # Add the name to the retry file if it can't be fetched or isn't a keystore
+        #? The derivation path is matched in the raw payload, so keystores are never parsed.
+        if not util.KEYSTORE_PATH_PATTERN.search(raw_secret_string):
+            print(f"\t[{yellow}-{end}] Could not fetch secret {secret_name}. Adding it to the retry file.")
+            if retry_file is None:
+                retry_file = open(f"{retry_file_path}.tmp", "w", encoding="utf-8")
+            retry_file.write(f"{secret_name}\n")
             continue
 
-        # Else add it to the read_secrets
-        print (f"\t[{green}✓{end}] Found {secret_name} in Google Cloud Secret Manager - {counter}/{len(secrets_to_read)}")
-        
         # Get timestamp from key name
         #? The timestamp is in the secret name keystore-m_12381_3600_i_0_0-timestamp
         timestamp = secret_name.split("-")[-1]
-        
-        read_secrets.append(f"{timestamp}:{raw_secret_string}")
-        counter += 1
 
+        written += 1
+        keystore_name = get_util.write_secret(f"{timestamp}:{raw_secret_string}", output)
+        print (f"\t[{green}✓{end}] Wrote {secret_name} to {keystore_name} - {written}/{total}")
 
-    # Write keys
-    print (f"\n[INFO] Writing {bold}{yellow}{len(read_secrets)}{end} secrets",
-           f"to '{blue}{output_dir}/imported_validator_keys/'{end}.")
+    get_util.close_output(output)
 
-    get_util.write_secrets(read_secrets, os.path.join(output_dir, "imported_validator_keys"))
+    # Report the secrets to retry
+    #? The retry file is swapped in once the input file is fully read, as they can be the same file.
+    if retry_file is None and os.path.exists(retry_file_path):
+        os.remove(retry_file_path)
+    if retry_file is not None:
+        retry_file.close()
+        os.replace(f"{retry_file_path}.tmp", retry_file_path)
+        print(f"\n[{yellow}WARN{end}] Could not fetch {total - written} secrets.",
+              f"Their names are in {blue}{retry_file_path}{end}.",
+              f"\n\tRun {print_usage_string_for_command_subcommand_and_flag('secrets', 'get', f'--from-file={retry_file_path}')} to retry them.")
 
-    print(f"\n\n[{green}SUCCESS{end}] Key import succesful.",
-          f"Check {green}{os.path.join(output_dir, 'imported_validator_keys')}{end}.\n")
+    print(f"\n\n[{green}SUCCESS{end}] Key import succesful. Wrote {written} keys.",
+          f"Check {green}{get_util.describe_output(keys_dir, archive)}{end}.\n")
 
     return
+
+def read_secret_names(file_name: str):
+    """
+    Streams the secret names in the file, one per line. Blank lines are skipped.
+
+    Returns: A generator of secret names.
+    """
+    with open(file_name, "r", encoding="utf-8") as file:
+        for line in file:
+            secret_name = line.strip()
+            if secret_name:
+                yield secret_name
+
+def fetch_secret(client: util.secretmanager.SecretManagerServiceClient, project_id: str,
+                 secret_name: str) -> tuple:
+    """
+    Reads a single secret. Errors that remain after the retries of util.call_secret_manager, and
+    payloads that aren't text, return an empty payload, so the secret goes to the retry file
+    instead of stopping the run.
+
+    Returns: A tuple str:secret_name, str:payload, or an empty payload if the secret can't be read.
+    """
+    try:
+        return get_util.read_named_secret(client, project_id, secret_name)
+    except exceptions.GoogleAPICallError as error:
+        print(f"\t[{red}x{end}] Error reading {secret_name}: {error.message}")
+        return secret_name, ""
+    except UnicodeDecodeError:
+        print(f"\t[{red}x{end}] Error reading {secret_name}: the payload isn't a keystore.")
+        return secret_name, ""
@@ -2,12 +2,15 @@
 
 import os
 import sys
+import contextlib
 
 import secrets.validation_logic as logic
 import secrets.get.validation_logic as get_logic
 import secrets.get.index_range as get_range
 import secrets.get.secret_name as get_name
 import secrets.get.from_file as get_file
+import secrets.get.pubkey as get_pubkey
+import secrets.get.cache as get_cache
     
 from cli.pretty.colors import red, end
 
@@ -23,6 +26,10 @@ def handler(subcommand_flags: list, project_id: str, output_dir: str):
     by_range = False
     by_name = False
     by_file = False
+    pubkeys = []
+    concurrency = 1
+    cache_megabytes = 0
+    archive = ""
 
     # Unpack subcommand flags
     while subcommand_flags:
@@ -44,28 +51,53 @@ def handler(subcommand_flags: list, project_id: str, output_dir: str):
             # Check for index range
             if "--index-range" in flag:
                 by_range = True
-                low, high = get_logic.validate_index_range(flag, flag_value)
+                ranges = get_logic.validate_index_ranges(flag, flag_value)
             
             # Check for index range
             if "--from-file" in flag:
                 by_file = True
                 file_name = get_logic.validate_file_name(flag_value)
 
+            # Check for pubkeys
+            if "--pubkeys-file" in flag:
+                pubkeys += get_logic.validate_pubkeys_file(flag, flag_value)
+            elif "--pubkey" in flag:
+                pubkeys.append(get_logic.validate_pubkey(flag, flag_value))
+
+            # Check for execution settings
+            if "--concurrency" in flag:
+                concurrency = logic.validate_concurrency(flag, flag_value)
+            if "--cache" in flag:
+                cache_megabytes = logic.validate_concurrency(flag, flag_value)
+            if "--archive" in flag:
+                archive = flag_value
+
     # No commands passed
-    if not any([by_file, by_name, by_range]):
+    if not any([by_file, by_name, by_range, pubkeys]):
         print(f"[{red}ERROR{end}] No subcommand flags passed.")
         sys.exit(1)
 
     # Check overwirte
-    if not logic.check_and_confirm_overwrite([os.path.join(output_dir, "imported_validator_keys")], output_dir):
+    #? Nothing is overwritten when streaming the archive to stdout.
+    outputs = [archive] if archive else [os.path.join(output_dir, "imported_validator_keys")]
+    if archive != "-" and not logic.check_and_confirm_overwrite(outputs, output_dir):
         return
 
-    # Route to subcommand in order of priority
-    if by_name:
-        get_name.get_secrets_from_name(project_id, output_dir, target_secret_name)
-    elif by_range:
-        get_range.get_secrets_from_index_range(low, high, project_id, output_dir)
-    elif by_file:
-        get_file.get_secrets_from_file(file_name, project_id, output_dir)
+    # Print to stderr when the archive goes to stdout, so it can be piped
+    with contextlib.redirect_stdout(sys.stderr if archive == "-" else sys.stdout):
+
+        # Route to subcommand in order of priority
+        if by_name:
+            get_name.get_secrets_from_name(project_id, output_dir, target_secret_name, archive)
+        elif by_range:
+            cache = get_cache.open_cache(output_dir, cache_megabytes) if cache_megabytes else None
+            get_range.get_secrets_from_index_range(ranges, project_id, output_dir, concurrency,
+                                                  cache, archive)
+        elif by_file:
+            get_file.get_secrets_from_file(file_name, project_id, output_dir, concurrency,
+                                           archive)
+        elif pubkeys:
+            get_pubkey.get_secrets_from_pubkeys(list(dict.fromkeys(pubkeys)), project_id, output_dir,
+                                                concurrency, archive)
     
     return
@@ -1,97 +1,168 @@
-"""Fetches all keys from secret manager within a provided index"""
+"""Fetches all keys from secret manager within the provided index ranges"""
 import os
 import sys
+import functools
 
 import secrets.utilities as util
 import secrets.get.utilities as get_util
+import secrets.get.cache as get_cache
+import keystores.indexes as indexes
 
 from cli.pretty.colors import green, end, red, yellow, bold
 
-def get_secrets_from_index_range(low: int, high: int, project_id: str, output_dir: str):
+def get_secrets_from_index_range(ranges: list, project_id: str, output_dir: str,
+                                 concurrency: int = 1, cache: get_cache.FatCache = None,
+                                 archive: str = ""):
     """
-    Scans Google Cloud Secret Manager and fetches the keys that fall within the provided range.
+    Scans Google Cloud Secret Manager and fetches the keys that fall within the provided ranges.
     It then creates the appropriate keystore for those keys.
-    Caller should pre-validate low and high.
+    The overlapping secrets are worked out up front, and every secret is fetched once, however
+    many of the ranges it holds.
+    Caller should pre-validate and merge the ranges.
     
     Args:
-        low: the low index of the key to get.
-        high: the high index of the key to get.
+        ranges: List of tuples (low, high) of the key indexes to get, sorted and not overlapping.
+            Single indexes are ranges with the same low and high.
         project_id: Google Cloud project id where to look for secrets.
         output_dir: Output directory defined in .env
+        concurrency: Number of secrets fetched in parallel. 1 runs serially.
+        cache: Optional local cache of the fat secrets from get_cache.open_cache.
+        archive: Optional tar archive path to write the keys to, see get_util.open_output.
     """
 
-    # Get secret manager client and set pattern
+    # Get secret manager client
     client = util.create_sm_client()
-    pattern = r"key-index_(0|[1-9]\d*)_to_(0|[1-9]\d*)"
-
-    # Get all matching secret names and sort them
-    secret_names = util.get_secret_names_matching_pattern(client, project_id, pattern)
-    secret_names = sorted(secret_names, key=lambda x:int(x.split("_")[1])) # Sorts on the low index
-    print (f"[INFO] Found {len(secret_names)} total 'fat' secrets.")
 
-    # Set in range secrets
-    in_range_secrets = [] #? This is a list of dictionaries
-
-    # Find secret names within the low - high range
-    print (f"\n[INFO] Searching for keys in the range {low} to {high}...")
-    for secret in secret_names:
-
-        # Process the secret and find index boundaries
-        #? Both low index and high are inclusive.
-        #? In 'key-index_0_to_5' key index 0 and 5 exist in the secret.
-        s_low, s_high = secret.strip("key-index_").split("_to_")
-        s_low, s_high = int(s_low), int(s_high)
-
-        print (f"\t[-] Scanning secret containing keys in range {s_low} to {s_high}.")
-
-        # Low index only is in this range, read from low to EOF
-        if s_low <= low <= s_high <= high:
-            in_range_secrets += get_util.read_secret_range(client, project_id, secret, low, s_high,
-                                                         s_low, s_high)
-           
-        # Both low index and high are in this range, read from low to high
-        elif s_low <= low <= high <= s_high:
-            in_range_secrets += get_util.read_secret_range(client, project_id, secret, low, high,
-                                                         s_low, s_high)
-
-        # Both low index and high are outside of this range, read whole file
-        elif low <= s_low <= s_high <= high:
-            in_range_secrets += get_util.read_secret_range(client, project_id, secret, s_low, s_high,
-                                                         s_low, s_high)
-
-        # High index only is in this range, read from secret low to high
-        elif low <= s_low <= high <= s_high:
-            in_range_secrets += get_util.read_secret_range(client, project_id, secret, s_low, high,
-                                                         s_low, s_high)
-        # Check if all secrets found and break.
-        if high < s_high:
-            break
+    # Find the fat secrets within the ranges from the catalog secret, else list them
+    print (f"[INFO] Searching for keys in {indexes.format_ranges(ranges)}...")
+    secret_ranges = get_util.read_catalog(client, project_id, ranges)
+    from_catalog = secret_ranges is not None
+    if from_catalog:
+        print (f"\t[{green}✓{end}] Found {len(secret_ranges)} 'fat' secrets in the '{util.CATALOG_SECRET_NAME}' catalog.")
+    else:
+        print ("\t[-] No catalog covering the ranges. Listing all 'fat' secrets.")
+        secret_ranges = list_fat_secrets(client, project_id)
+
+    # Fetch the secrets
+    in_range_secrets = fetch_secret_ranges(client, project_id, secret_ranges, ranges,
+                                           concurrency, cache)
+
+    # List the secrets and fetch again if the catalog is stale
+    if in_range_secrets is None and from_catalog:
+        print(f"\n[{yellow}WARN{end}] The '{util.CATALOG_SECRET_NAME}' catalog is stale. Listing all 'fat' secrets.")
+        secret_ranges = list_fat_secrets(client, project_id)
+        in_range_secrets = fetch_secret_ranges(client, project_id, secret_ranges, ranges,
+                                               concurrency, cache)
+
+    if in_range_secrets is None:
+        print(f"\n[{red}ERROR{end}] Secrets changed while reading them. Please try again.")
+        sys.exit(1)
 
     # Check if no keys were found, and exit if not
-    if low > s_high:
-        print(f"\n[{red}ERROR{end}] Provided low index {bold}{low}{end} out of range found in Secret Manager.")
+    requested = sum(high - low + 1 for low, high in ranges)
+    if not in_range_secrets:
+        print(f"\n[{red}ERROR{end}] Provided indexes {bold}{indexes.format_ranges(ranges)}{end} out of range found in Secret Manager.")
         sys.exit(1)
 
-    elif high > s_high:
-        print(f"\n[{yellow}WARN{end}] Provided high index {bold}{high}{end} beyond the range found in Secret Manager.",
-              f"\n\tMissing {bold}{high-s_high}{end} secrets.",
+    elif len(in_range_secrets) < requested:
+        print(f"\n[{yellow}WARN{end}] Some provided indexes are not in Secret Manager.",
+              f"\n\tMissing {bold}{requested - len(in_range_secrets)}{end} secrets.",
               f"Ignoring and writing {len(in_range_secrets)} found secrets.")
     else:
         print (f"\t[{green}✓{end}] All keys found.")
 
-    print (f"\n[INFO] Found {len(in_range_secrets)} keys in the range {low} to {high}.")
+    print (f"\n[INFO] Found {len(in_range_secrets)} keys in {indexes.format_ranges(ranges)}.")
     
     # Unpack the low and high index
-    _, low_secret = util.get_secret_timestamp_and_value(in_range_secrets[0])
-    low_found = util.get_key_index(low_secret, "keystore")
-    _, high_secret = util.get_secret_timestamp_and_value(in_range_secrets[-1])    
-    high_found = util.get_key_index(high_secret, "keystore")
+    low_found = util.get_line_key_index(in_range_secrets[0])
+    high_found = util.get_line_key_index(in_range_secrets[-1])
     print (f"\t[-] From indexes {low_found} to {high_found}.")
 
     # Write keys
+    keys_dir = os.path.join(output_dir, "imported_validator_keys")
     print (f"\n[INFO] Writing {len(in_range_secrets)} keys",
-           f"to '{output_dir}/imported_validator_keys/'...")
-    get_util.write_secrets(in_range_secrets, os.path.join(output_dir, "imported_validator_keys"))
-    print(f"\n\n[{green}SUCCESS{end}] Key import succesful. Check {green}{os.path.join(output_dir, 'imported_validator_keys')}{end}.\n")
+           f"to '{get_util.describe_output(keys_dir, archive)}'...")
+    get_util.write_secrets(in_range_secrets, keys_dir, archive)
+    print(f"\n\n[{green}SUCCESS{end}] Key import succesful. Check {green}{get_util.describe_output(keys_dir, archive)}{end}.\n")
 
     return
+
+def list_fat_secrets(client: util.secretmanager.SecretManagerServiceClient, project_id: str) -> list:
+    """
+    Lists all the fat secrets in the project. Exits if there are none.
+
+    Returns: A list of tuples (str:secret_name, int:s_low, int:s_high) sorted by low index.
+    """
+    pattern = r"key-index_(0|[1-9]\d*)_to_(0|[1-9]\d*)"
+
+    # Get all matching secret names and sort them
+    secret_names = list(util.get_secret_names_matching_pattern(client, project_id, pattern))
+    print (f"\t[-] Found {len(secret_names)} total 'fat' secrets.")
+
+    if not secret_names:
+        print(f"\n[{red}ERROR{end}] No 'fat' secrets found in Secret Manager.")
+        sys.exit(1)
+
+    # Process the secrets and find index boundaries
+    #? Both low index and high are inclusive.
+    #? In 'key-index_0_to_5' key index 0 and 5 exist in the secret.
+    secret_ranges = []
+    for secret in secret_names:
+        s_low, s_high = secret.strip("key-index_").split("_to_")
+        secret_ranges.append((secret, int(s_low), int(s_high)))
+
+    return sorted(secret_ranges, key=lambda x: x[1]) # Sorts on the low index
+
+def fetch_secret_ranges(client: util.secretmanager.SecretManagerServiceClient, project_id: str,
+                        secret_ranges: list, ranges: list, concurrency: int,
+                        cache: get_cache.FatCache = None) -> list:
+    """
+    Plans the reads of the secrets overlapping the ranges, fetches them concurrently and merges
+    the keys in index order. Every secret is fetched once, however many of the ranges it holds.
+
+    Args:
+        client: A Google Cloud secret manager client.
+        project_id: Google Cloud project id where to look for secrets.
+        secret_ranges: List of tuples (secret_name, s_low, s_high) sorted by low index.
+        ranges: List of tuples (low, high) of the key indexes to get, sorted and not overlapping.
+        concurrency: Number of secrets fetched in parallel. 1 runs serially.
+        cache: Optional local cache of the fat secrets. Cached versions aren't downloaded again.
+
+    Returns: A list of in range <index>:<timestamp>:<secret-contents> strings, or None if a
+        planned secret doesn't exist.
+    """
+    # Plan the reads of the secrets within the ranges
+    #? This is a list of tuples (secret, [(read_low, read_high)...], s_low, s_high)
+    fetch_plan = []
+    for secret, s_low, s_high in secret_ranges:
+
+        # Check if all secrets found and break.
+        if s_low > ranges[-1][1]:
+            break
+
+        # Read the overlap of the secret and every range, if any
+        targets = [(max(low, s_low), min(high, s_high)) for low, high in ranges
+                   if low <= s_high and s_low <= high]
+        if targets:
+            print (f"\t[-] Reading keys {indexes.format_ranges(targets)} from secret containing keys in range {s_low} to {s_high}.")
+            fetch_plan.append((secret, targets, s_low, s_high))
+
+    # Fetch the planned secrets and merge them in index order
+    #? Results come back in plan order regardless of the concurrency.
+    print (f"\n[INFO] Fetching {len(fetch_plan)} secrets with {concurrency} worker(s)...")
+    names_to_fetch = [secret for secret, _, _, _ in fetch_plan]
+    if cache:
+        read = functools.partial(get_cache.read_cached_secret, client, cache, project_id)
+    else:
+        read = functools.partial(get_util.read_named_secret, client, project_id)
+    results = util.map_concurrently(read, names_to_fetch, concurrency)
+
+    in_range_secrets = [] #? This is a list of <index>:<timestamp>:<secret-contents> strings
+    for (secret, targets, s_low, s_high), (_, raw_payload) in zip(fetch_plan, results):
+        if not raw_payload:
+            print (f"\t[{red}x{end}] Secret {secret} not found.")
+            return None
+        in_range_secrets += get_util.slice_secret_ranges(raw_payload, targets, s_low, s_high)
+        print (f"\t[{green}✓{end}] Fetched {secret}.")
+
+    return in_range_secrets
@@ -0,0 +1,133 @@
+"""Fetches the keys of the provided validator pubkeys from secret manager"""
+import os
+import re
+import sys
+import functools
+
+import secrets.utilities as util
+import secrets.get.utilities as get_util
+
+from cli.pretty.colors import green, end, yellow, bold, blue, red
+
+def get_secrets_from_pubkeys(pubkeys: list, project_id: str, output_dir: str,
+                             concurrency: int = 1, archive: str = ""):
+    """
+    Looks up the provided pubkeys in the pubkey index written by 'upload' and fetches the
+    secrets holding them. Every secret is fetched once, however many of the pubkeys it holds.
+    It then creates the appropriate keystore for those keys.
+    Caller should pre-validate the pubkeys.
+
+    Args:
+        pubkeys: List of validator pubkeys, as lowercase hex strings without '0x'.
+        project_id: Google Cloud project id where to look for secrets.
+        output_dir: Output directory defined in .env, holding the pubkey index.
+        concurrency: Number of secrets fetched in parallel. 1 runs serially.
+        archive: Optional tar archive path to write the keys to, see get_util.open_output.
+    """
+    # Resolve the pubkeys to the secrets and positions holding them
+    index_path = os.path.join(output_dir, util.PUBKEY_INDEX_FILE_NAME)
+    print(f"\n[INFO] Looking up {yellow}{bold}{len(pubkeys)}{end} pubkeys in {blue}{index_path}{end}.")
+    secret_to_positions = read_pubkey_index(index_path, set(pubkeys))
+
+    # Warn about the pubkeys that aren't in the index
+    found = {pubkey for positions in secret_to_positions.values() for _, pubkey in positions}
+    for pubkey in pubkeys:
+        if pubkey not in found:
+            print(f"\t[{yellow}-{end}] Pubkey {pubkey} not found in the index. Ignoring it.")
+
+    if not secret_to_positions:
+        print(f"\n[{red}ERROR{end}] None of the pubkeys are in the index.")
+        sys.exit(1)
+
+    # Fetch the secrets
+    #? Results come back in index order regardless of the concurrency.
+    secret_names = list(secret_to_positions)
+    print (f"\n[INFO] Fetching {len(secret_names)} secrets holding {len(found)} keys",
+           f"with {concurrency} worker(s)...")
+    client = util.create_sm_client()
+    results = util.map_concurrently(functools.partial(get_util.read_named_secret, client, project_id),
+                                    secret_names, concurrency)
+
+    # Write the keys of every secret as it arrives
+    keys_dir = os.path.join(output_dir, "imported_validator_keys")
+    output = get_util.open_output(keys_dir, archive)
+    written = 0
+    for secret_name, raw_payload in results:
+        if not raw_payload:
+            print(f"\t[{red}x{end}] Secret {secret_name} not found. Skipping its keys.")
+            continue
+
+        for str_secret in get_pubkey_lines(secret_name, raw_payload, secret_to_positions[secret_name]):
+            written += 1
+            keystore_name = get_util.write_secret(str_secret, output)
+            print(f"\t[{green}✓{end}] Wrote {keystore_name} from {secret_name} - {written}/{len(found)}")
+
+    get_util.close_output(output)
+
+    print(f"\n\n[{green}SUCCESS{end}] Key import succesful. Wrote {written} keys.",
+          f"Check {green}{get_util.describe_output(keys_dir, archive)}{end}.\n")
+
+    return
+
+def read_pubkey_index(index_path: str, pubkeys: set) -> dict:
+    """
+    Scans the pubkey index once, keeping the entries of the provided pubkeys.
+
+    Args:
+        index_path: Path to the index, with <pubkey> <secret_name> <position> lines.
+        pubkeys: Set of pubkeys to look up.
+
+    Returns: A dict of secret name to a list of tuples (int:position, str:pubkey) in the secret.
+    """
+    if not os.path.isfile(index_path):
+        print(f"\n[{red}ERROR{end}] Pubkey index {index_path} not found.",
+              "\n\tIt's written by 'secrets upload'. Copy it to the output directory of this machine.")
+        sys.exit(1)
+
+    secret_to_positions = {}
+    with open(index_path, "r", encoding="utf-8") as f:
+        for line in f:
+            pubkey, secret_name, position = line.split()
+            if pubkey in pubkeys:
+                secret_to_positions.setdefault(secret_name, []).append((int(position), pubkey))
+        f.close()
+
+    return secret_to_positions
+
+def get_pubkey_lines(secret_name: str, raw_payload: str, positions: list) -> list:
+    """
+    Picks the keys of the provided positions out of a secret payload.
+    Keys that moved since the index was written, for example after re-uploading the secret with
+    a different format, are searched for in the whole payload.
+
+    Args:
+        secret_name: The name of the secret.
+        raw_payload: The decoded payload of the secret.
+        positions: List of tuples (int:position, str:pubkey) of the keys to pick.
+
+    Returns: A list of strings in the format <timestamp>:<secret> or <index>:<timestamp>:<secret>
+    """
+    # Single secrets hold one keystore, and the timestamp is in their name
+    #? The timestamp is in the secret name keystore-m_12381_3600_i_0_0-timestamp
+    if re.match(util.SINGLE_SECRET_PATTERN, secret_name):
+        lines = [f"{secret_name.split('-')[-1]}:{raw_payload}"]
+    else:
+        lines = get_util.process_raw_payload(raw_payload)
+
+    picked = []
+    for position, pubkey in positions:
+        #? No other keystore field holds a 96 character hex string, so a substring check is
+        #? enough to tell keys apart without parsing the keystore.
+        quoted_pubkey = f'"{pubkey}"'
+        if position < len(lines) and quoted_pubkey in lines[position]:
+            picked.append(lines[position])
+            continue
+
+        # Search for keys that moved
+        matching_lines = [line for line in lines if quoted_pubkey in line]
+        if matching_lines:
+            picked.append(matching_lines[0])
+        else:
+            print(f"\t[{yellow}-{end}] Pubkey {pubkey} not found in {secret_name}. Ignoring it.")
+
+    return picked
@@ -10,7 +10,7 @@ from cli.pretty.colors import green, end, red
 from cli.utilities import print_usage_string_for_command_subcommand_and_flag
 
 
-def get_secrets_from_name(project_id: str, output_dir: str, secret_name: str):
+def get_secrets_from_name(project_id: str, output_dir: str, secret_name: str, archive: str = ""):
     """
     Gets a Google Cloud Secret Manager and fetches the secret that matches the provided name.
     
@@ -18,6 +18,7 @@ def get_secrets_from_name(project_id: str, output_dir: str, secret_name: str):
         project_id: Google Cloud project id where to look for secrets.
         output_dir: Output directory defined in .env
         target_secret: The name of the secret to be read
+        archive: Optional tar archive path to write the key to, see get_util.open_output.
     """
 
     # Get secret manager client
@@ -41,12 +42,13 @@ def get_secrets_from_name(project_id: str, output_dir: str, secret_name: str):
     print (f"[INFO] Found {secret_name} in Google Cloud Secret Manager.")
 
     # Write keys
+    keys_dir = os.path.join(output_dir, 'imported_validator_keys')
     print (f"\n[INFO] Writing {secret_name}",
-           f"to '{os.path.join(output_dir, 'imported_validator_keys')}'.")
+           f"to '{get_util.describe_output(keys_dir, archive)}'.")
 
     timestamp = secret_name.split("-")[-1]
-    get_util.write_secrets([f"{timestamp}:{raw_secret_payload}"],os.path.join(output_dir, "imported_validator_keys"))
+    get_util.write_secrets([f"{timestamp}:{raw_secret_payload}"], keys_dir, archive)
 
     print(f"\n\n[{green}SUCCESS{end}] Key import succesful.",
-          f"Check {os.path.join(output_dir, 'imported_validator_keys')}.\n")
+          f"Check {get_util.describe_output(keys_dir, archive)}.\n")
     return
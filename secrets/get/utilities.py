@@ -1,128 +1,177 @@
 """Utilities for the get subcommand on secrets command"""
 
-import json
+import io
 import os
+import sys
+import time
+import bisect
+import tarfile
 
 import secrets.utilities as util
 
-def read_secret_range(client: util.secretmanager.SecretManagerServiceClient,
-                      project_id: str, secret_name: str, target_low: int, target_high: int,
-                      secret_low, secret_high) -> list:
+from google.api_core import exceptions
+
+# Directory of the keystores inside the archives, as when writing them to the output directory
+ARCHIVE_KEYS_DIRECTORY = "imported_validator_keys"
+
+def slice_secret_ranges(raw_payload: str, targets: list, secret_low: int, secret_high: int) -> list:
     """
-    Reads the latest version of a 'fat' secret and returns only the keys within a given range.
+    Slices the keys within the given ranges out of the payload of a 'fat' secret, splitting the
+    payload once for all of them.
     Works only for key secrets with format key-index_l_to_h, where l and h are integers and l<h.
-    Caller must pre-validate that the low and high are in range (low >= l and high <= h).
+    Caller must pre-validate that the ranges are in the secret, sorted and don't overlap.
     The secret is guaranteed to be sorted from low to high key index when getting created.
     
     Args:
-        client: A Google Cloud secret manager client.
-        project_id: Google Cloud project ID where to read the secrets from
-        secret_name: The secret name
-        low: The low key index to start reading from.
-        high: The high key index to stop reading at.
+        raw_payload: The decoded payload of the latest version of the secret.
+        targets: List of tuples (target_low, target_high) of the key indexes to read.
+        secret_low: The low key index of the secret (l).
+        secret_high: The high key index of the secret (h).
 
-    Returns: A list os dictionaries mapping {secret-payload:timestamp}
+    Returns: A list of strings in the format <index>:<timestamp>:<secret-contents>, or
+        <timestamp>:<secret-contents> for secrets uploaded before the index prefix was added.
     """
-    # Read the secret contents and turn a fat payload into a list of strings
-    timestamped_payload_str_list = process_raw_payload(read_secret(client, project_id, secret_name))
-
-    #? Note: There are only 3 conditions under which this function is invoked:
-    #? 1. Either only the low or high target index is in the range, find it.
-    #? 2. Both target indexes in the range, find both.
-    #? 3. Both target indexes outside the range, read the whole file.
+    # Turn a fat payload into a list of strings
+    timestamped_payload_str_list = process_raw_payload(raw_payload)
 
     # Check when the whole file needs to be read and return immediately
-    if target_low == secret_low and secret_high == target_high:
+    if targets == [(secret_low, secret_high)]:
         return timestamped_payload_str_list
 
-    # Find low
-    elif target_low > secret_low and secret_high == target_high:
-        lli = binary_search(timestamped_payload_str_list, target_low) #low list index
-        return timestamped_payload_str_list[lli:]
-
-    # Find high
-    elif target_low == secret_low and secret_high < target_high:
-        hli = binary_search(timestamped_payload_str_list, target_high) #high list index
-        return timestamped_payload_str_list[:hli]
+    # Read the key indexes and bisect them for every range
+    #? Only the line prefixes are read. See util.get_line_key_index for older lines without one.
+    key_indexes = [util.get_line_key_index(line) for line in timestamped_payload_str_list]
+    sliced = []
+    for target_low, target_high in targets:
+        lli = bisect.bisect_left(key_indexes, target_low)
+        hli = bisect.bisect_right(key_indexes, target_high)
+        sliced += timestamped_payload_str_list[lli:hli]
 
-    #Find both
-    lli = binary_search(timestamped_payload_str_list, target_low)
-    hli = binary_search(timestamped_payload_str_list, target_high)
-
-    return timestamped_payload_str_list[lli:hli+1] # +1 because you want the last index too
+    return sliced
 
 def process_raw_payload(raw: str) -> list:
     """
     Processes the raw payload of a fat secret.
-    Returns: A list of strings in the format <timestamp>:<secret-contents>, where each secret content is a json string.
+    Returns: A list of strings in the format <index>:<timestamp>:<secret-contents>, where each secret content is a json string.
     """
     secret_string_list = raw.strip().split('\n')
     return [buff for buff in secret_string_list]
 
-def binary_search(payload: list, target: int) -> int:
-    """Performs binary search on the payload to find the list index of the key with index == target"""
-    l = 0
-    h = len(payload)
-
-    while l <= h:
-        mid = (l + h) // 2
-        
-        # Get the index
-        _, secret = util.get_secret_timestamp_and_value(payload[mid])
-        key_index = util.get_key_index(secret, "keystore")
-
-        # Return if found
-        if key_index == target:
-            return mid
-
-        # Go right
-        if target > key_index:
-            l = mid+1
-
-        #Go left
-        else:
-            h = mid-1
-
-    return -1
-
-def write_secrets(timestamp_to_secret_list: list, output_dir: str):
+def write_secrets(timestamp_to_secret_list: list, output_dir: str, archive: str = ""):
     """
-    Writes the secrets in the list to output_dir.
+    Writes the secrets in the list to output_dir, or to an archive.
     It writes in format keystore-m_12381_3600_i_0_0-timestamp.json, where i is the key index.
+    The directory is synced once all the secrets are written.
     
     Args:
         - timestamp_to_secrets_list: A list of strings in the format
-        <timestamp>:<secret>, where <secret> is a JSON string of the secret payload.
+        <timestamp>:<secret> or <index>:<timestamp>:<secret>, where <secret> is a JSON string
+        of the secret payload.
         - output_dir: The output directory to write the secrets to.
+        - archive: Optional tar archive path to write to instead, see open_output.
     """
-    # Create output dir if it does not exist:
-    os.makedirs(os.path.dirname(output_dir), exist_ok=True)
+    output = open_output(output_dir, archive)
 
     total = len(timestamp_to_secret_list)
     curr = 1
 
     for str_secret in timestamp_to_secret_list:
-        # Get the timestamp and secret value
-        timestamp, secret = util.get_secret_timestamp_and_value(str_secret)
-        
-        # Get key index and set file name
-        i = util.get_key_index(secret, mode="keystore")
-        keystore_name = f"keystore-m_12381_3600_{i}_0_0-{timestamp}.json"
+        keystore_name = write_secret(str_secret, output)
+        print(f"\t[-] Wrote secret to {keystore_name} - {curr}/{total}")
+        curr += 1
 
-        print(f"\t[-] Writing secret to {keystore_name} - {curr}/{total}")
+    close_output(output)
 
-        # Write
-        path = os.path.join(output_dir, keystore_name)
-        with open(path, "w", encoding="utf-8") as f:
-            f.write(json.dumps(secret).strip("\n")) #Strip leading or trailing \n
-            f.close()
+    return
 
-        # Set the file to read-only
-        os.chmod(path, 0o440)  # Read-read-none permissions
+def open_output(output_dir: str, archive: str = ""):
+    """
+    Opens the output the keystores are written to.
+        - Without an archive, output_dir is created if needed and keystores are written as files.
+        - With an archive path, keystores are streamed into a tar archive, gzip compressed if the
+        path ends in .gz or .tgz. The archive holds the keystores under imported_validator_keys/.
+        - With '-' as the archive, an uncompressed tar archive is streamed to stdout.
+
+    Returns: The output to pass to write_secret and close_output. Either the output_dir path or
+        an open tarfile.TarFile.
+    """
+    if not archive:
+        os.makedirs(output_dir, exist_ok=True)
+        return output_dir
+
+    #? Stream modes ('w|') never seek, so they work on pipes and only buffer a block at a time.
+    #? The original stdout is used, as the caller may redirect prints away from it.
+    if archive == "-":
+        return tarfile.open(fileobj=sys.__stdout__.buffer, mode="w|")
+    return tarfile.open(archive, mode="w|gz" if archive.endswith((".gz", ".tgz")) else "w|")
+
+def describe_output(output_dir: str, archive: str = "") -> str:
+    """Returns where open_output writes the keystores, for printing"""
+    if archive == "-":
+        return "stdout"
+    return archive or output_dir
+
+def close_output(output):
+    """Closes the output from open_output. Syncs the directory, or finishes the archive."""
+    if isinstance(output, tarfile.TarFile):
+        output.close()
+    else:
+        sync_directory(output)
+
+def write_secret(str_secret: str, output) -> str:
+    """
+    Writes a single secret as a read-only keystore file to a directory or an archive.
+    The keystore is written byte for byte as stored in the secret, so its hash matches the
+    original keystore. In a directory, the file is written to a temporary name and renamed into
+    place, so a keystore file is never partially written.
+    Caller should call close_output once done writing.
 
-        curr += 1
+    Args:
+        - str_secret: A string in the format <timestamp>:<secret> or <index>:<timestamp>:<secret>,
+        where <secret> is a JSON string of the secret payload.
+        - output: The output from open_output, or an existing output directory.
 
-    return
+    Returns: The keystore file name, keystore-m_12381_3600_i_0_0-timestamp.json
+    """
+    # Get key index and timestamp, and set file name
+    #? The keystore JSON isn't parsed, see util.get_line_key_index.
+    _, timestamp, secret = util.split_fat_line(str_secret)
+    i = util.get_line_key_index(str_secret)
+    keystore_name = f"keystore-m_12381_3600_{i}_0_0-{timestamp}.json"
+
+    # Add the keystore to the archive with the permissions of the written files
+    if isinstance(output, tarfile.TarFile):
+        data = secret.encode("utf-8")
+        info = tarfile.TarInfo(f"{ARCHIVE_KEYS_DIRECTORY}/{keystore_name}")
+        info.size = len(data)
+        info.mode = 0o440  # Read-read-none permissions
+        info.mtime = int(time.time())
+        output.addfile(info, io.BytesIO(data))
+        return keystore_name
+
+    # Write to a temporary file, flushed to disk
+    path = os.path.join(output, keystore_name)
+    temp_path = os.path.join(output, f".{keystore_name}.tmp")
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(secret)
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+
+    # Set the file to read-only and move it into place
+    #? Renaming replaces read-only keystores from previous imports, which opening them can't.
+    os.chmod(temp_path, 0o440)  # Read-read-none permissions
+    os.replace(temp_path, path)
+
+    return keystore_name
+
+def sync_directory(output_dir: str):
+    """Flushes the directory entries of output_dir to disk, making the renamed keystores durable"""
+    fd = os.open(output_dir, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
 def read_secret(client: util.secretmanager.SecretManagerServiceClient,
                       project_id: str, secret_name: str) -> str:
@@ -132,12 +181,69 @@ def read_secret(client: util.secretmanager.SecretManagerServiceClient,
         client: A Google Cloud secret manager client.
         project_id: Google Cloud project ID where to read the secrets from
         secret_name: The secret name
-    Returns the string payload of the secret.
+    Returns the string payload of the secret. Compressed fat payloads are decompressed.
     """
     # Set secret name
     name = f"projects/{project_id}/secrets/{secret_name}/versions/latest"
 
     # Get secret latest version, decode, and process the payload
-    response = client.access_secret_version(request={"name": name})
+    response = util.call_secret_manager("access", client.access_secret_version, {"name": name})
+
+    return util.decode_payload(response.payload.data)
+
+def read_named_secret(client: util.secretmanager.SecretManagerServiceClient, project_id: str,
+                      secret_name: str) -> tuple:
+    """
+    Reads the latest version of a secret, keeping its name along with the payload.
 
-    return response.payload.data.decode("UTF-8")
+    Returns: A tuple str:secret_name, str:payload, or an empty payload if the secret doesn't exist.
+    """
+    try:
+        return secret_name, read_secret(client, project_id, secret_name)
+    except exceptions.NotFound:
+        return secret_name, ""
+
+def read_catalog(client: util.secretmanager.SecretManagerServiceClient, project_id: str,
+                 ranges: list) -> list:
+    """
+    Reads the catalog secret with a single access and binary searches it for the fat secrets
+    holding the keys of every range.
+
+    Args:
+        client: A Google Cloud secret manager client.
+        project_id: Google Cloud project id where to look for secrets.
+        ranges: List of tuples (low, high) of key indexes, sorted and not overlapping.
+
+    Returns: A list of tuples (str:secret_name, int:s_low, int:s_high) sorted by low index, or
+        None if the catalog is missing or doesn't cover every range without gaps.
+    """
+    _, raw_catalog = read_named_secret(client, project_id, util.CATALOG_SECRET_NAME)
+    if not raw_catalog:
+        return None
+    rows = util.parse_catalog(raw_catalog)
+    row_highs = [row[1] for row in rows]
+
+    secret_ranges = []
+    for low, high in ranges:
+        # Find the first secret ending at or after the low index
+        start = bisect.bisect_left(row_highs, low)
+
+        # Collect the secrets until the high index
+        range_secrets = []
+        for s_low, s_high, secret_name, _ in rows[start:]:
+            if s_low > high:
+                break
+            range_secrets.append((secret_name, s_low, s_high))
+
+        # Check the secrets cover the whole range
+        #? A gap means the catalog is stale or keys are missing, so the caller lists the secrets instead.
+        if not range_secrets or range_secrets[0][1] > low or range_secrets[-1][2] < high:
+            return None
+        for (_, _, previous_high), (_, next_low, _) in zip(range_secrets, range_secrets[1:]):
+            if next_low != previous_high + 1:
+                return None
+
+        # Add the secrets not shared with the previous range
+        secret_ranges += [secret for secret in range_secrets if secret not in secret_ranges[-1:]]
+
+    return secret_ranges
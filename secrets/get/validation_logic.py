@@ -1,14 +1,35 @@
 """Handles validation logic for get subcommand of secrets command"""
 import sys
 import os
+import re
 
 from cli.pretty.colors import bg_black, yellow, end, bold, red
 
 # Validate Functions
+def validate_index_ranges(flag_head: str, ranges_str: str) -> list:
+    """
+    Validates the provided comma separated list of index ranges and single indexes, as in
+    '5,900_950,12000'. Exists without returning upon invalid values.
+    The ranges are sorted and overlapping or adjacent ranges are merged.
+
+    Returns: A list of tuples (low_index, high_index). Single indexes have the same low and high.
+    """
+    ranges = [validate_index_range(flag_head, range_str) for range_str in ranges_str.split(",")]
+
+    # Merge the sorted ranges that overlap or touch
+    merged = []
+    for low, high in sorted(ranges):
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(high, merged[-1][1]))
+        else:
+            merged.append((low, high))
+
+    return merged
+
 def validate_index_range(flag_head: str, range_str: str) -> tuple:
     """
-    Validates the provided index range. Exists without returning upon invalid values.
-        1. Checks for two indices
+    Validates the provided index range or single index. Exists without returning upon invalid values.
+        1. Checks for one or two indices
         2. Checks for valid integers
         3. Checks they exist within the bounds of existing secret manager secretes [TODO]
 
@@ -16,14 +37,15 @@ def validate_index_range(flag_head: str, range_str: str) -> tuple:
     """
     split_range = range_str.split("_")
 
-    # Check for only two indexes
-    if len(split_range) != 2:
+    # Check for one or two indexes
+    if len(split_range) not in [1, 2]:
         print(f"\n{red}[ERROR]{end} Invalid flag value '{bg_black}{range_str}{end}' for",
               f"flag '{yellow}{flag_head}{end}'.")
         sys.exit(1)
 
     # Get low and high ranges and check they are numbers
-    low, high = split_range[0], split_range[1]
+    #? A single index is a range with the same low and high.
+    low, high = split_range[0], split_range[-1]
     if not low.isnumeric():
         print(f"\n{red}[ERROR]{end} Invalid low index {bold}{low}{end}. Please enter a valid positive integer.")
         sys.exit(1)
@@ -34,7 +56,7 @@ def validate_index_range(flag_head: str, range_str: str) -> tuple:
 
     # Transform to numbers and check low < high
     low, high = int(low), int(high)
-    if low >= high:
+    if len(split_range) == 2 and low >= high:
         print(f"\n{red}[ERROR]{end} Low index {low} greater than or equal to high index {high}.")
         sys.exit(1)
 
@@ -60,3 +82,37 @@ def validate_file_name(file_name: str) -> tuple:
 
     # Return the file name
     return file_name
+
+def validate_pubkey(flag_head: str, pubkey: str) -> str:
+    """
+    Validates a validator pubkey, a 48 byte BLS12-381 public key in hex. Exits without
+    returning upon invalid values.
+
+    Returns: The pubkey as lowercase hex without the '0x' prefix, as written in the keystores.
+    """
+    pubkey = pubkey.strip().lower()
+    pubkey = pubkey[2:] if pubkey.startswith("0x") else pubkey
+
+    if not re.match(r'^[0-9a-f]{96}$', pubkey):
+        print(f"\n{red}[ERROR]{end} Invalid pubkey '{bg_black}{pubkey}{end}' for flag '{yellow}{flag_head}{end}'.",
+              "Pubkeys are 96 hex characters, with or without '0x'.")
+        sys.exit(1)
+
+    return pubkey
+
+def validate_pubkeys_file(flag_head: str, file_name: str) -> list:
+    """
+    Validates the pubkeys in a file with one pubkey per line. Blank lines are skipped.
+
+    Returns: The list of unique pubkeys, in file order.
+    """
+    validate_file_name(file_name)
+
+    pubkeys = []
+    with open(file_name, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                pubkeys.append(validate_pubkey(flag_head, line))
+        f.close()
+
+    return list(dict.fromkeys(pubkeys))
@@ -5,6 +5,9 @@ import secrets.validation_logic as validation_logic
 import secrets.delete.handler as delete
 import secrets.upload.handler as upload
 import secrets.get.handler as get
+import secrets.sync.handler as sync
+import secrets.prune.handler as prune
+import secrets.audit.handler as audit
 
 def handler(_, subcommand, subcommand_flags):
     """
@@ -30,4 +33,10 @@ def handler(_, subcommand, subcommand_flags):
     elif subcommand == "get":
         get.handler(subcommand_flags, project_id, output_dir)
     elif subcommand == "delete":
-        delete.handler(subcommand_flags, project_id)
\ No newline at end of file
+        delete.handler(subcommand_flags, project_id, output_dir)
+    elif subcommand == "sync":
+        sync.handler(subcommand_flags, project_id, key_directory_path)
+    elif subcommand == "prune":
+        prune.handler(subcommand_flags, project_id)
+    elif subcommand == "audit":
+        audit.handler(subcommand_flags, project_id, key_directory_path)
\ No newline at end of file
@@ -0,0 +1 @@
+"""Prune module for secrets package"""
\ No newline at end of file
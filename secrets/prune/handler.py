@@ -0,0 +1,70 @@
+"""Handler for the 'prune' subcommand of secrets command"""
+
+import sys
+
+import secrets.validation_logic as logic
+import secrets.prune.prune_versions as pruner
+
+from cli.pretty.colors import red, end, green, yellow, bold
+
+def handler(subcommand_flags: list, project_id: str):
+    """
+    Handles prune subcommand logic.
+        1. Unpacks subcommand flags
+        2. Lists the superseded versions
+        3. Gets confirmation, or stops on a dry run
+        4. Destroys the versions
+
+    Args:
+        - subcommand_flags: List of subcommand flags
+        - project_id: The Google Cloud Project ID to prune secret versions from
+    """
+    # Intialize flags
+    keep = 1
+    dry_run = False
+    skip_confirm = False
+    concurrency = 1
+
+    # Unpack subcommand flags
+    while subcommand_flags:
+        flag = subcommand_flags.pop()
+        if "--keep" in flag:
+            keep = logic.validate_concurrency("--keep", flag.split("=")[1])
+        elif flag == "--dry-run":
+            dry_run = True
+        elif flag == "--skip-confirmation":
+            skip_confirm = True
+        elif "--concurrency" in flag:
+            concurrency = logic.validate_concurrency("--concurrency", flag.split("=")[1])
+
+    # List the versions to destroy
+    superseded, skipped_names = pruner.get_superseded_versions(project_id, keep, concurrency)
+    if skipped_names:
+        print(f"\n{yellow}[WARN]{end} Skipping {len(skipped_names)} secrets that aren't keystore secrets:")
+        for secret_name in skipped_names:
+            print(f"\t[{yellow}-{end}] {secret_name}")
+    savings = pruner.get_monthly_savings(len(superseded))
+    print(f"\n[INFO] Found {bold}{len(superseded)}{end} versions older than the newest {keep} of their secret.",
+          f"Destroying them saves an estimated {green}${savings}{end} per month.")
+
+    if not superseded or dry_run:
+        print(f"\n[{green}SUCCESS{end}] Nothing destroyed.\n")
+        return
+
+    # Get confirmation
+    if not skip_confirm:
+        input_message = f"{yellow}[WARN]{end} You are about to destroy {len(superseded)} secret versions. This action is {red}{bold}irreversible{end}.\n\tDo you want to proceed?{end} (yes only - anything else will halt.)\n\t\t"
+        response = input(input_message)
+        if response.lower() != 'yes':
+            print("\n\nAborting.\n")
+            sys.exit(1)
+
+    # Destroy the versions
+    destroyed = pruner.destroy_versions(superseded, concurrency)
+    if destroyed < len(superseded):
+        print(f"\n[{red}ERROR{end}] Destroyed {destroyed} of {len(superseded)} versions. Run the prune again to retry the rest.\n")
+        sys.exit(1)
+
+    print(f"\n[{green}SUCCESS{end}] Succesfully destroyed {destroyed} versions.\n")
+
+    return
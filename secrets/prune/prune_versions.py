@@ -0,0 +1,125 @@
+"""Destroys the superseded versions of the keystore secrets"""
+import re
+import functools
+
+import secrets.utilities as util
+
+from google.api_core import exceptions
+from cli.pretty.colors import green, end, yellow, red, bold
+
+# Secret Manager price of an active (enabled or disabled) secret version, in USD per month.
+#? https://cloud.google.com/secret-manager/pricing. Destroyed versions aren't billed.
+VERSION_MONTHLY_PRICE = 0.06
+
+def get_superseded_versions(project_id: str, keep: int, concurrency: int = 1) -> tuple:
+    """
+    Lists the active versions of every fat and single secret in the project, and collects all but
+    the newest 'keep' versions of each secret.
+
+    Args:
+        project_id: Google Cloud project id where to look for secrets.
+        keep: Number of newest versions kept on every secret.
+        concurrency: Number of secrets listed in parallel. 1 runs serially.
+
+    Returns: A tuple of
+        - A list of the full names of the superseded versions.
+        - A sorted list of the names matched by the server-side filter that aren't keystore secrets.
+    """
+    client = util.create_sm_client()
+
+    # List the secrets with a server-side filter
+    #? The filter matches substrings, e.g. 'backup-key-index_old', so every name is checked against
+    #? the fat and single secret patterns before any of its versions is touched.
+    #? The catalog secret isn't matched by the filter, so its history is left alone.
+    listed_names = sorted(util.list_secret_names(client, project_id, util.get_name_filter("key-index_", "keystore-m_")))
+    secret_names, skipped_names = [], []
+    for name in listed_names:
+        if re.match(util.FAT_SECRET_PATTERN, name) or re.match(util.SINGLE_SECRET_PATTERN, name):
+            secret_names.append(name)
+        else:
+            skipped_names.append(name)
+    print(f"\n[INFO] Listing the versions of {len(secret_names)} secrets with {concurrency} worker(s)...")
+
+    results = util.map_concurrently(functools.partial(list_superseded_versions, client, project_id, keep),
+                                    secret_names, concurrency)
+
+    return [version_name for superseded in results for version_name in superseded], skipped_names
+
+def list_superseded_versions(client: util.secretmanager.SecretManagerServiceClient, project_id: str,
+                             keep: int, secret_name: str) -> list:
+    """
+    Lists the active versions of a secret and returns all but the newest 'keep' ones.
+
+    Args:
+        client: the Secret Manager client
+        project_id: Google Cloud project id where to look for secrets.
+        keep: Number of newest versions to keep.
+        secret_name: The name of the secret.
+
+    Returns: A list of the full names of the superseded versions, newest first.
+    """
+    request = {"parent": f"projects/{project_id}/secrets/{secret_name}",
+               "filter": util.SM_ACTIVE_VERSIONS_FILTER, "page_size": util.SM_LIST_PAGE_SIZE}
+    try:
+        version_names = [version.name for version in
+                         util.list_pages(client.list_secret_versions, request, "versions")]
+
+    #? The secret was deleted after the listing.
+    except exceptions.NotFound:
+        return []
+
+    return util.sort_versions(version_names)[keep:]
+
+def destroy_versions(version_names: list, concurrency: int = 1) -> int:
+    """
+    Destroys all the provided secret versions. Destroying is idempotent, so versions already
+    destroyed or deleted along with their secret count as destroyed.
+
+    Args:
+        version_names: List of the full names of the versions to destroy.
+        concurrency: Number of versions destroyed in parallel. 1 runs serially.
+
+    Returns: The number of versions destroyed
+    """
+    print (f"\n[INFO] Destroying {len(version_names)} versions with {concurrency} worker(s)...")
+
+    results = util.map_concurrently(functools.partial(destroy_version, util.create_sm_client(), len(version_names)),
+                                    enumerate(version_names, start=1), concurrency)
+
+    destroyed = sum(1 for done in results if done)
+    if destroyed < len(version_names):
+        print(f"\n[{red}ERROR{end}] Failed to destroy {bold}{len(version_names) - destroyed}{end} versions.")
+
+    return destroyed
+
+def destroy_version(client: util.secretmanager.SecretManagerServiceClient, total: int,
+                    position_and_name: tuple) -> bool:
+    """
+    Destroys a single secret version.
+
+    Args:
+        client: the Secret Manager client
+        total: Total number of versions to destroy, for logging purposes
+        position_and_name: Tuple of (position of the version in the run, full version name)
+
+    Returns: True if the version is destroyed, False if destroying it failed.
+    """
+    i, version_name = position_and_name
+    try:
+        util.call_secret_manager("write", client.destroy_secret_version, {"name": version_name})
+
+    #? NotFound if the secret was deleted, FailedPrecondition if the version was already destroyed.
+    except (exceptions.NotFound, exceptions.FailedPrecondition):
+        print(f"\t[{yellow}-{end}] Version {version_name} was already destroyed - {i}/{total}")
+        return True
+
+    except exceptions.GoogleAPICallError as error:
+        print(f"\t[{red}x{end}] Error destroying {version_name}: {error.message} - {i}/{total}")
+        return False
+
+    print(f"\t[{green}✓{end}] Destroyed {version_name} - {i}/{total}")
+    return True
+
+def get_monthly_savings(version_count: int) -> float:
+    """Returns the estimated monthly cost in USD of the provided number of active versions"""
+    return round(version_count * VERSION_MONTHLY_PRICE, 2)
@@ -0,0 +1 @@
+"""Sync module for secrets package"""
\ No newline at end of file
@@ -0,0 +1,35 @@
+"""Handler for the 'sync' subcommand of secrets command"""
+
+import secrets.validation_logic as logic
+import secrets.sync.sync_secrets as syncer
+
+def handler(subcommand_flags: list, project_id: str, key_directory_path: str):
+    """
+    Handles sync subcommand logic.
+        1. Unpacks subcommand flags
+        2. Routes to sync execution
+
+    Args:
+        - subcommand_flags: List of subcommand flags
+        - project_id: The Google Cloud Project ID to sync secrets to
+        - key_directory_path: Path to the local keystore files
+    """
+    # Intialize flags
+    delete_removed = False
+    skip_confirm = False
+    concurrency = 1
+
+    # Unpack subcommand flags
+    while subcommand_flags:
+        flag = subcommand_flags.pop()
+        if flag == "--delete-removed":
+            delete_removed = True
+        elif flag == "--skip-confirmation":
+            skip_confirm = True
+        elif "--concurrency" in flag:
+            concurrency = logic.validate_concurrency("--concurrency", flag.split("=")[1])
+
+    # Route to sync execution
+    syncer.sync_secrets(project_id, key_directory_path, concurrency, delete_removed, skip_confirm)
+
+    return
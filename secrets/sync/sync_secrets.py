@@ -0,0 +1,124 @@
+"""Uploads only the keystores that are new or changed since the last upload"""
+import re
+import hashlib
+import functools
+
+import secrets.utilities as util
+import secrets.upload.utilities as upload_util
+import secrets.delete.utilities as de_util
+import secrets.delete.delete_secrets as del_executer
+
+from google.cloud import secretmanager
+from cli.pretty.colors import green, end, red, yellow, bold
+
+def sync_secrets(project_id: str, key_directory_path: str, concurrency: int = 1,
+                 delete_removed: bool = False, skip_confirm: bool = False):
+    """
+    Syncs the keystores in key_directory_path with their single secrets on Secret Manager.
+    Remote hashes come from the secret annotations of a single list_secrets pass, so keys that
+    didn't change cost no calls at all.
+
+    Args:
+        project_id: Google cloud project ID where the secrets live
+        key_directory_path: Path to keystore files
+        concurrency: Number of keys uploaded in parallel. 1 runs serially.
+        delete_removed: Boolean flag to delete the secrets of keystores no longer in key_directory_path
+        skip_confirm: Boolean flag to skip the confirmation prompt before deleting
+    """
+    # Get filenames and client
+    client = util.create_sm_client()
+    files = upload_util.get_keyfiles(key_directory_path)
+
+    # Get the remote hashes
+    remote_hashes = get_remote_hashes(client, project_id)
+    print(f"[INFO] Found {len(remote_hashes)} keystore secrets in Google Cloud Secret Manager.")
+
+    # Compare against the local hashes
+    #? A secret without the hash annotation was never synced and counts as changed.
+    print(f"\n[INFO] Comparing {len(files)} local keystores...")
+    local_names = set()
+    to_upload = [] #? List of tuples (secret_name, payload_bytes, exists)
+    for key_file in files:
+        secret_name = upload_util.get_secret_name(key_file)
+        local_names.add(secret_name)
+
+        #? Read the same way as 'upload', so both hash the same payload bytes.
+        with open(key_file.path, "r", encoding="utf-8") as f:
+            payload_bytes = f.read().encode("utf-8")
+            f.close()
+
+        if remote_hashes.get(secret_name) != hashlib.sha256(payload_bytes).hexdigest():
+            to_upload.append((secret_name, payload_bytes, secret_name in remote_hashes))
+
+    removed = sorted(name for name in remote_hashes if name not in local_names)
+    print(f"\t[-] {len(files) - len(to_upload)} unchanged, {len(to_upload)} new or changed,",
+          f"{len(removed)} no longer in the key directory.")
+
+    # Upload the new and changed keystores
+    if to_upload:
+        print(f"\n[INFO] Uploading {len(to_upload)} keystores with {concurrency} worker(s)...")
+        upload = functools.partial(sync_secret, client, project_id, len(to_upload))
+        for _ in util.map_concurrently(upload, enumerate(to_upload, start=1), concurrency):
+            pass
+
+    # Delete the secrets of removed keystores
+    if delete_removed and removed:
+        de_util.confirm_delete(skip_confirm, "list", removed) # This will exit if confirmation is not succesful
+        del_executer.delete_secrets(client, removed, project_id)
+    elif removed:
+        print(f"\n[{yellow}WARN{end}] Keeping {bold}{len(removed)}{end} secrets of keystores no longer in",
+              "the key directory. Pass '--delete-removed' to delete them.")
+
+    print(f"\n[{green}SUCCESS{end}] Sync complete. Uploaded {len(to_upload)} keystores.\n")
+
+def get_remote_hashes(client: secretmanager.SecretManagerServiceClient, project_id: str) -> dict:
+    """
+    Lists all the single keystore secrets in the project along with their stored hash.
+
+    Returns: A dict of secret name to the SHA256 hex of its keystore, or None if not annotated.
+    """
+    pattern = r'^keystore-m_12381_3600_\d+_0_0-\d+$'
+    remote_hashes = {}
+
+    #? The list response carries the annotations, so no secret is read.
+    raw_secrets = util.list_secrets(client, project_id, util.get_name_filter(pattern), lambda secret: secret)
+    for secret in raw_secrets:
+        secret_name = secret.name.split("/")[-1]
+        if re.match(pattern, secret_name):
+            remote_hashes[secret_name] = secret.annotations.get(util.SHA256_ANNOTATION)
+
+    return remote_hashes
+
+def sync_secret(client: secretmanager.SecretManagerServiceClient, project_id: str, total: int,
+                position_and_key: tuple) -> str:
+    """
+    Uploads a new or changed keystore: creates the secret if needed, adds the version, verifies
+    it and stores the new hash.
+
+    Args:
+        client: Google Cloud secret manager client
+        project_id: Google cloud project ID where the secrets live
+        total: Total number of keys to upload, for logging purposes
+        position_and_key: Tuple of (position of the key in the run, (secret_name, payload_bytes, exists))
+
+    Returns: The secret name
+    """
+    i, (secret_name, payload_bytes, exists) = position_and_key
+
+    # Create the secret if it is new
+    if not exists:
+        upload_util.create_secret_if_not_exists(client, project_id, secret_name, set())
+
+    # Add secret version and verify the checksum
+    version = upload_util.add_secret_version(client, project_id, secret_name, payload_bytes)
+    if not upload_util.verify_crc32c(version):
+        print(f"\t[{red}x{end}] Data corruption detected on {secret_name}. Panicing.")
+        exit(1)
+
+    # Store the hash last, so an interrupted sync uploads this key again
+    upload_util.set_secret_sha256(client, project_id, secret_name, payload_bytes)
+
+    status = "Updated" if exists else "Created"
+    print(f"\t[{green}✓{end}] {status} {secret_name} - {i}/{total}")
+
+    return secret_name
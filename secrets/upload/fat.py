@@ -1,6 +1,8 @@
 """Puts all the keys into as few secrets as possible."""
 
+import zlib
 import json
+import functools
 
 import secrets.upload.utilities as upload_util
 import secrets.utilities as util
@@ -8,148 +10,247 @@ import secrets.utilities as util
 from google.cloud import secretmanager
 from cli.pretty.colors import green, end, red, blue
 
-def create_fat_secrets(project_id: str, key_directory_path: str, output_dir: str):
+#? Bytes kept free in a zlib fat payload for the end of the compressed stream.
+#? Finishing an already sync flushed stream adds an empty block and the adler32 checksum.
+FAT_ZLIB_TRAILER_SIZE = 16
+
+def create_fat_secrets(project_id: str, key_directory_path: str, output_dir: str,
+                       checksum_mode: str = "crc32c", concurrency: int = 1,
+                       fat_format: str = "zlib", resume: bool = False):
     """
     Scans the key_directory_path and builds a payload as close to the Secret Manager
     secret size limit. It outsources the secret building to create_secret once the limit
-    size is reached. 
-        
+    size is reached.
+    Packing runs as a producer on the calling thread while up to 'concurrency' workers
+    create the secrets, so reading keystores and network writes overlap.
+
     Args:
         project_id: Google cloud project ID where the secrets will live
         key_directory_path: Path to keystore files
         output_dir: Output path for txt files for local records
+        checksum_mode: How created versions are verified. 'crc32c' or 'sha256' (read-back).
+        concurrency: Number of secrets created in parallel. 1 runs serially.
+        fat_format: Payload format of the secrets. 'zlib' (compressed) or 'plain'.
+        resume: Boolean flag to skip the keys committed in the upload journal of a previous run
     """
 
     # Get filenames and clinet
     client = util.create_sm_client()
     files = upload_util.get_keyfiles(key_directory_path)
+    total_files = len(files)
+
+    # Open the upload journal and create storing dict with the committed secrets
+    journal, committed_entries = upload_util.open_journal(output_dir, resume)
+    secret_name_to_pubkeys = {entry["secret_name"]: entry["pubkeys"] for entry in committed_entries}
+    catalog_entries = list(committed_entries)
+
+    # Create counters
+    keys_scanned = sum(len(pubkeys) for pubkeys in secret_name_to_pubkeys.values()) #? Tracks the number of keys read
+    secrets_created = 0 #? Tracks the number of secrets created
+
+    # Skip the keys committed in a previous run
+    #? The journal is written in index order, so the remaining keys are packed into new
+    #? secrets that start right after the last committed one.
+    if resume:
+        committed = upload_util.get_committed_indexes(committed_entries)
+        files = [f for f in files if f.index not in committed]
+        print(f"[INFO] Resuming upload. Skipping {len(committed_entries)} committed secrets,",
+              f"{len(files)} keys remaining.")
+
+    # Take a snapshot of the existing secrets
+    #? One paged list call replaces a get_secret call per secret to check for existence.
+    existing_secrets = util.list_secret_names(client, project_id,
+                                              util.get_name_filter("key-index_", util.CATALOG_SECRET_NAME))
+
+    print(f"[INFO] Scanning Secrets in '{fat_format}' format with {concurrency} upload worker(s).")
+    # Hand every packed payload to the upload workers
+    #? Results come back in index order regardless of the concurrency, so local records
+    #? are identical to a serial run.
+    upload = functools.partial(create_secret, client, project_id, checksum_mode, existing_secrets)
+    results = util.map_concurrently(upload, pack_fat_payloads(files, fat_format), concurrency)
+
+    #? Every secret is journaled as it comes back, so a crash loses at most the in flight secrets.
+    for entry in results:
+        upload_util.append_to_journal(journal, entry)
+        secret_name_to_pubkeys[entry["secret_name"]] = entry["pubkeys"]
+        catalog_entries.append(entry)
+        keys_scanned += len(entry["pubkeys"])
+        secrets_created += 1
+    journal.close()
+
+    # Print secret creation completion message
+    print ("\n[INFO] Secret creation completed.",
+           f"\n\t[{green}✓{end}] Scanned {keys_scanned}/{total_files} secrets.",
+           f"\n\t[{green}✓{end}] Created {secrets_created} secrets."
+           "\n\tCheck Google Cloud Secret Manager.")
 
-    # Create storing dict, pubkeys list, and indexes
-    secret_name_to_pubkeys = {}
+    # Update the catalog of fat secrets
+    print(f"\n[INFO] Adding {len(catalog_entries)} secrets to the '{util.CATALOG_SECRET_NAME}' catalog secret.")
+    upload_util.update_catalog(client, project_id, catalog_entries, existing_secrets)
+
+    # Save local records
+    print("\n[INFO] Saving validator pubkeys and secret names locally.")
+    upload_util.save_validator_pubkey_and_name(secret_name_to_pubkeys, output_dir)
+    print(f"\n\n[{green}SUCCESS{end}] Secret creation and local trackign complete. Check {blue}{output_dir}{end}.\n")
+
+def pack_fat_payloads(files: list, fat_format: str = "zlib"):
+    """
+    Reads the keystores in order and packs them into payloads as close to the 64kb
+    Secret Manager limit as possible.
+    In 'zlib' format the limit applies to the compressed payload, so many more keystores fit
+    in each secret.
+
+    Args:
+        files: KeystoreFile records sorted by key index
+        fat_format: Payload format of the secrets. 'zlib' (compressed) or 'plain'.
+
+    Returns: A generator of tuples (bytes:payload, list:pubkeys, int:low_index, int:high_index),
+        one per secret to create.
+    """
+    # Nothing to pack
+    if not files:
+        return
+
+    # Create pubkeys list and indexes
     pubkeys = []
 
     # Get the low index of the first key included in this file
-    low_index = util.get_key_index(files[0], "file") #? Tracks the lowest key index included in any given payload
+    low_index = files[0].index #? Tracks the lowest key index included in any given payload
     key_i = 1 #? Tracks the number of keys read
-    secrets_created = 0 #? Tracks the number of secrets created
 
     # Initialize payload metric variables
+    #? The zlib format keeps room for the header byte and the end of the compressed stream.
     max_payload_size = 64 * 1024  # 64 KB in bytes
+    if fat_format == "zlib":
+        max_payload_size -= len(util.FAT_FORMAT_ZLIB) + FAT_ZLIB_TRAILER_SIZE
+    compressor = util.new_fat_compressor() if fat_format == "zlib" else None
     current_payload_size = 0
-    payloads = []
+    chunks = []
 
-    print("[INFO] Scanning Secrets.")
     # Iterate through all json files in keys directory
-    for key_file_name in files:
-        
+    for key_file in files:
+
         # Read contents of json into str
-        with open(f"{key_file_name}", 'r', encoding="utf-8") as f:
+        with open(key_file.path, 'r', encoding="utf-8") as f:
             raw_contents = f.read()
             f.close()
 
-        # Get key index
+        # Get key index and timestamp, parsed from the file name by the scanner
         #? Index is i in m/12381/3600/i/0/0 - See EIP2334
         #? https://eips.ethereum.org/EIPS/eip-2334
-        #? This path is printed into the default filename keystore-m_12381_3600_i_0_0-timestamp.json
-        #? https://github.com/ethereum/staking-deposit-cli/blob/master/staking_deposit/credentials.py#L155
-        key_index = util.get_key_index(key_file_name, "file")
-
-        # Get key timestamp
         #? The timestamp is necessary to rebuild the secret name and will be written to the
-        #? fat secret in the format: <timestamp>:<secret-contents>
-        #? The timestamp exists only in the file name.
-        timestamp = key_file_name.strip(".json").split("/")[-1].split("-")[-1]
+        #? fat secret in the format: <index>:<timestamp>:<secret-contents>
+        #? The timestamp exists only in the file name. The index prefix saves readers from
+        #? parsing the keystore to find it.
+        key_index = key_file.index
+        timestamp = key_file.timestamp
 
-        # Concatenate the timestamp and contents
-        contents = f"{timestamp}:{raw_contents}"
+        # Concatenate the index, timestamp, contents and newline
+        line = f"{key_index}:{timestamp}:{raw_contents}\n".encode("utf-8")
 
-        print(f"\t[{green}✓{end}] Read {key_file_name} - {key_i}/{len(files)}")
+        print(f"\t[{green}✓{end}] Read {key_file.path} - {key_i}/{len(files)}")
 
-        # Create secret if adding this JSON data to the payload would exceed the limit
-        data_size = len(contents.encode("utf-8"))
-        if current_payload_size + data_size + 1 > max_payload_size: # +1 for the newline char
+        # Hand the payload over if adding this line to the payload would exceed the limit
+        chunk, next_compressor = append_line(compressor, line, current_payload_size, max_payload_size)
+        if current_payload_size + len(chunk) > max_payload_size:
             print("\n[INFO] Payload 64kib limit reached.")
-            secret_name_to_pubkeys = create_secret(client, project_id, payloads, current_payload_size,
-                                                   secret_name_to_pubkeys, pubkeys, low_index, key_index-1)
-
-            # Reset payloads and pubkeys list, low index, and content size.
-            # Add to secrets created
-            payloads = [contents]
-            payloads.append("\n")
-            pubkeys = [json.loads(raw_contents)["pubkey"]]
+            yield finish_payload(compressor, chunks), pubkeys, low_index, key_index-1
+
+            # Reset the compressor, chunks and pubkeys list, low index, and content size.
+            compressor = util.new_fat_compressor() if fat_format == "zlib" else None
+            chunk, next_compressor = append_line(compressor, line, 0, max_payload_size)
+            chunks = []
+            pubkeys = []
             low_index = key_index
-            current_payload_size = data_size + 1  # Add 1 for the newline character
-            secrets_created += 1
+            current_payload_size = 0
 
-        # Else add the contents and a newline character to the payload.
-        # Increase the payload size and add pubkey to list
-        else:
-            payloads.append(contents)
-            payloads.append("\n")
-            pubkeys.append(json.loads(raw_contents)["pubkey"])
-            current_payload_size += data_size + 1  # Add 1 for the newline character
+        # Add the chunk to the payload, increase the payload size and add pubkey to list
+        compressor = next_compressor
+        chunks.append(chunk)
+        pubkeys.append(json.loads(raw_contents)["pubkey"])
+        current_payload_size += len(chunk)
 
         key_i += 1
 
-    # Create the final secret if the payloads list is not empty
-    if len(payloads) > 0:
+    # Hand over the final payload if the chunks list is not empty
+    if len(chunks) > 0:
         print("\n[INFO] Remaining payload after secret scan completed.")
-        secret_name_to_pubkeys = create_secret(client, project_id, payloads, current_payload_size,
-                                               secret_name_to_pubkeys, pubkeys, low_index, key_index)
-        secrets_created += 1
+        yield finish_payload(compressor, chunks), pubkeys, low_index, key_index
 
-    # Print secret creation completion message
-    print ("\n[INFO] Secret creation completed.",
-           f"\n\t[{green}✓{end}] Scanned {key_i-1}/{len(files)} secrets.",
-           f"\n\t[{green}✓{end}] Created {secrets_created} secrets."
-           "\n\tCheck Google Cloud Secret Manager.")
+def append_line(compressor, line: bytes, current_payload_size: int, max_payload_size: int) -> tuple:
+    """
+    Encodes a keystore line as the next chunk of a fat payload.
+    For the 'plain' format (no compressor) the chunk is the line itself.
+    For the 'zlib' format the line is compressed and sync flushed, so the chunk size is exact.
 
-    # Save local records
-    print("\n[INFO] Saving validator pubkeys and secret names locally.")
-    upload_util.save_validator_pubkey_and_name(secret_name_to_pubkeys, output_dir)
-    print(f"\n\n[{green}SUCCESS{end}] Secret creation and local trackign complete. Check {blue}{output_dir}{end}.\n")
+    Args:
+        compressor: The zlib compressor of the payload, or None for the 'plain' format.
+        line: The <index>:<timestamp>:<secret-contents> line, newline included.
+        current_payload_size: Size in bytes of the chunks already in the payload.
+        max_payload_size: Maximum size in bytes of the chunks in the payload.
+
+    Returns: A tuple bytes:chunk, compressor to keep using if the chunk is added to the payload.
+    """
+    if compressor is None:
+        return line, None
+
+    # Work on a copy of the compressor if this line could overflow the payload
+    #? Deflate never grows a line by more than a few bytes, so a copy is only needed close to
+    #? the limit, where the line may have to go to the next payload instead.
+    if current_payload_size + len(line) + FAT_ZLIB_TRAILER_SIZE > max_payload_size:
+        compressor = compressor.copy()
+
+    chunk = compressor.compress(line) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return chunk, compressor
+
+def finish_payload(compressor, chunks: list) -> bytes:
+    """Joins the chunks into the final payload bytes, adding the header and stream end in 'zlib' format"""
+    if compressor is None:
+        return b"".join(chunks)
+    return util.FAT_FORMAT_ZLIB + b"".join(chunks) + compressor.flush()
 
 def create_secret(client: secretmanager.SecretManagerServiceClient, project_id:str,
-                  payloads:list, payload_size:int, secret_names_to_pubkeys: dict, pubkeys: list, 
-                  low_index:int, high_index:int) -> dict:
+                  checksum_mode: str, existing_secrets: set, packed_payload: tuple) -> tuple:
     """Creates the atomic secret as close to 64 kb as possible.
 
     Args:
         client: Google Cloud secret manager client
         project_id: Google Cloud project id
-        paylods: List of paylods (containing newline characters) for the secret
-        payload_size: the size of the payload in bytes, for logging purposes
-        secret_names_to_pubkeys: Dictionary of secret names:pubkeys for internal record
-        pubkeys: List of all the pubkeys getting added to this secret
-        low_index: The smallest key index whose contents are getting written to the secret
-        high_index: The largest key index whose contents are getting written to the secret
+        checksum_mode: How the created version is verified. 'crc32c' or 'sha256' (read-back).
+        existing_secrets: Snapshot of the secret names in the project taken before the upload
+        packed_payload: A tuple from pack_fat_payloads containing
+            - payload_bytes: The encoded payload of the secret
+            - pubkeys: List of all the pubkeys getting added to this secret
+            - low_index: The smallest key index whose contents are getting written to the secret
+            - high_index: The largest key index whose contents are getting written to the secret
 
     Returns:
-        Updated secret_names_to_pubkeys map
+        The journal entry of the secret for internal record. A dict with the secret_name,
+        low_index, high_index, version, crc32c and pubkeys (list of the secret pubkeys).
     """
+    payload_bytes, pubkeys, low_index, high_index = packed_payload
+
     print(f"[INFO] Creating secret from index {low_index} to {high_index}",
-          f"and secret size {round(payload_size/1024, 2)}kb")
+          f"with {len(pubkeys)} keys and secret size {round(len(payload_bytes)/1024, 2)}kb")
 
 
     # Create secret if does not exist
     secret_name = f"key-index_{low_index}_to_{high_index}"
-    upload_util.create_secret_if_not_exists(client, project_id, secret_name)
-
-    # Get the payload string and bytes
-    payload_string = "".join(payloads)
-    payload_bytes = payload_string.encode(encoding="utf-8")
+    upload_util.create_secret_if_not_exists(client, project_id, secret_name, existing_secrets)
 
     # Add secret version
-    request={"parent": f"projects/{project_id}/secrets/{secret_name}",
-            "payload": {"data": payload_bytes}}
-    version = client.add_secret_version(request=request)
-    
-    # Verify payload calculate string SHA256
-    if upload_util.verify_payload(client, version, payload_string):
+    version = upload_util.add_secret_version(client, project_id, secret_name, payload_bytes)
+
+    # Verify payload checksums
+    if upload_util.verify_version(client, version, payload_bytes, checksum_mode):
         print(f"\t[{green}✓{end}] Matching checksums of secret manager and local data.\n")
-        secret_names_to_pubkeys[secret_name] = pubkeys
     else:
         print(f"\t[{red}x{end}] Data corruption detected. Panicing.")
         exit(1)
 
-    return secret_names_to_pubkeys
+    # Store the hash of the decoded payload for 'secrets audit'
+    #? The decoded payload only depends on the keystores, so it can be rebuilt from the key directory.
+    upload_util.set_secret_sha256(client, project_id, secret_name, util.decode_payload(payload_bytes).encode("utf-8"))
+
+    return {"secret_name": secret_name, "low_index": low_index, "high_index": high_index,
+            "version": version.name, "crc32c": util.get_crc32c(payload_bytes), "pubkeys": pubkeys}
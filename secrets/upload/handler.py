@@ -1,6 +1,7 @@
 """Handler for 'upload' subcommand on secrets command"""
 import os
 
+import secrets.utilities as util
 import secrets.validation_logic as logic
 import secrets.upload.single as single
 import secrets.upload.fat as fatty
@@ -15,6 +16,11 @@ def handler(subcommand_flags: list, project_id: str, key_directory_path: str, ou
     # Intialize flags
     skip = False
     optimistic = False
+    resume = False
+    secret_mode = "fat"
+    concurrency = 1
+    checksum_mode = "crc32c"
+    fat_format = "zlib"
 
     #Unpack subcommand flags
     while subcommand_flags:
@@ -23,22 +29,35 @@ def handler(subcommand_flags: list, project_id: str, key_directory_path: str, ou
             skip = True
         elif flag == "--optimistic":
             optimistic = True
+        elif flag == "--resume":
+            resume = True
         elif "--secret-mode" in flag:
             secret_mode = flag.split("=")[1]
+        elif "--fat-format" in flag:
+            fat_format = flag.split("=")[1]
+        elif "--checksum-mode" in flag:
+            checksum_mode = flag.split("=")[1]
+        elif "--concurrency" in flag:
+            concurrency = logic.validate_concurrency("--concurrency", flag.split("=")[1])
     
     #Confirm overwrite
+    #? A resumed run rebuilds the record files from its journal, so there is nothing to confirm.
     output_files = [
         os.path.join(output_dir, "public_keys.txt"),
         os.path.join(output_dir, "secret_names.txt"),
-        os.path.join(output_dir, "secret_names_to_pubkeys.txt")
+        os.path.join(output_dir, "secret_names_to_pubkeys.txt"),
+        os.path.join(output_dir, "upload_journal.jsonl"),
+        os.path.join(output_dir, util.PUBKEY_INDEX_FILE_NAME)
     ]
-    if not logic.check_and_confirm_overwrite(output_files, output_dir):
+    if not resume and not logic.check_and_confirm_overwrite(output_files, output_dir):
         return
 
     #Route to subcommand execution
     if secret_mode == "fat":
-        fatty.create_fat_secrets(project_id, key_directory_path, output_dir) #? Fat secrets don't skip nor are optimistic
+        fatty.create_fat_secrets(project_id, key_directory_path, output_dir, checksum_mode,
+                                 concurrency, fat_format, resume) #? Fat secrets don't skip nor are optimistic
     else:
-        single.create_single_secrets(project_id, key_directory_path, output_dir, optimistic, skip)
+        single.create_single_secrets(project_id, key_directory_path, output_dir, optimistic, skip,
+                                     concurrency, checksum_mode, resume)
 
     return
\ No newline at end of file
@@ -1,75 +1,62 @@
 """Puts all the keys into their own secret."""
 
 import json
+import functools
 
 import secrets.upload.utilities as upload_util
 import secrets.utilities as util
 
+from google.cloud import secretmanager
 from cli.pretty.colors import green, end, red
 
 def create_single_secrets(project_id: str, key_directory_path: str, output_dir: str,
-                          optimistic: bool, skip: bool):
+                          optimistic: bool, skip: bool, concurrency: int = 1,
+                          checksum_mode: str = "crc32c", resume: bool = False):
     """Creates secrets using the python library through the API.
-    
+
     Args:
         project_id: Google cloud project ID where the secrets will live
         key_directory_path: Path to keystore files
         output_dir: Output path for txt files for local records
         optimistic: Boolean flag to skip checking checksums
         skip: Boolean flag to skip version overwrite
+        concurrency: Number of keys processed in parallel. 1 runs serially.
+        checksum_mode: How created versions are verified. 'crc32c' or 'sha256' (read-back).
+        resume: Boolean flag to skip the keys committed in the upload journal of a previous run
     """
     # Get filenames and clinet
     client = util.create_sm_client()
     files = upload_util.get_keyfiles(key_directory_path)
 
-    # Initialize counter and local tracker
-    i = 1
-    secret_names_to_pubkeys = {}
-
-    print("[INFO] Creating Secrets...")
-    # Iterate through all keystores
-    for key_file_path in files:
-        
-        #Get the name of the secret only
-        key_file_name = key_file_path.split("/")[-1].strip(".json")
-        
-        # Create secret if does not exist
-        exists = upload_util.create_secret_if_not_exists(client, project_id, key_file_name)
-
-        # Read contents of json into str and pass to bytes
-        with open(f"{key_file_path}", 'r', encoding="utf-8") as f:
-            contents = f.read()
-            f.close()
-        payload_bytes = contents.encode("utf-8")
-
-        print(f"\t[{green}✓{end}] Read file {key_file_name} - {i}/{len(files)}")
-
-        # Skip version update if skip is set
-        if skip and exists:
-            print("\t\t[-] Skipping version update of existing secret.")
-            secret_names_to_pubkeys[key_file_name] = json.loads(contents)["pubkey"]
-            i += 1
-            continue
-
-        # Add secret version
-        request={"parent": f"projects/{project_id}/secrets/{key_file_name}",
-                "payload": {"data": payload_bytes}}
-        version = client.add_secret_version(request=request)
-
-        # Add secret and save keys and name to file if optimistic.
-        if optimistic:
-            secret_names_to_pubkeys[key_file_name] = json.loads(contents)["pubkey"]
-
-        # Else calculate string SHA256
-        else:
-            if upload_util.verify_payload(client, version, contents):
-                print(f"\t[{green}✓{end}] Matching checksums of secret manager and local data.")
-                secret_names_to_pubkeys[key_file_name] = json.loads(contents)["pubkey"]
-            else:
-                print(f"\t[{red}x{end}] Data corruption detected. Panicing.")
-                exit(1)
+    # Open the upload journal and initialize local tracker with the committed secrets
+    journal, committed_entries = upload_util.open_journal(output_dir, resume)
+    secret_names_to_pubkeys = {entry["secret_name"]: entry["pubkeys"] for entry in committed_entries}
+
+    # Skip the keys committed in a previous run
+    if resume:
+        committed = upload_util.get_committed_indexes(committed_entries)
+        files = [f for f in files if f.index not in committed]
+        print(f"[INFO] Resuming upload. Skipping {len(committed)} committed keys,",
+              f"{len(files)} keys remaining.")
 
-        i += 1
+    # Take a snapshot of the existing secrets
+    #? One paged list call replaces a get_secret call per key to check for existence.
+    existing_secrets = util.list_secret_names(client, project_id, util.get_name_filter("keystore-m_"))
+    print(f"[INFO] Found {len(existing_secrets)} existing single secrets in the project.")
+
+    print(f"[INFO] Creating Secrets with {concurrency} worker(s)...")
+    # Run the per key pipeline over all keystores
+    #? Results come back in index order regardless of the concurrency, so local records
+    #? are identical to a serial run.
+    upload = functools.partial(upload_single_secret, client, project_id, len(files), optimistic, skip,
+                               checksum_mode, existing_secrets)
+    results = util.map_concurrently(upload, enumerate(files, start=1), concurrency)
+
+    #? Every secret is journaled as it comes back, so a crash loses at most the in flight keys.
+    for entry in results:
+        upload_util.append_to_journal(journal, entry)
+        secret_names_to_pubkeys[entry["secret_name"]] = entry["pubkeys"]
+    journal.close()
 
     print ("\n[INFO] Secret creation completed .",
            "Check Google Cloud Secret Manager.")
@@ -77,3 +64,64 @@ def create_single_secrets(project_id: str, key_directory_path: str, output_dir:
     upload_util.save_validator_pubkey_and_name(secret_names_to_pubkeys, output_dir)
     print(f"\n\n[{green}SUCCESS{end}] Secret creation and local saving complete. Check {output_dir}\n")
 
+def upload_single_secret(client: secretmanager.SecretManagerServiceClient, project_id: str,
+                         total: int, optimistic: bool, skip: bool, checksum_mode: str,
+                         existing_secrets: set, position_and_path: tuple) -> tuple:
+    """
+    Runs the full pipeline for a single keystore: creates the secret if needed, adds the
+    version and verifies it.
+
+    Args:
+        client: Google Cloud secret manager client
+        project_id: Google cloud project ID where the secrets will live
+        total: Total number of keys, for logging purposes
+        optimistic: Boolean flag to skip checking checksums
+        skip: Boolean flag to skip version overwrite
+        checksum_mode: How the created version is verified. 'crc32c' or 'sha256' (read-back).
+        existing_secrets: Snapshot of the secret names in the project taken before the upload
+        position_and_path: Tuple of (position of the key in the run, KeystoreFile record)
+
+    Returns: The journal entry of the secret. A dict with the secret_name, low_index and
+        high_index (both the key index), version, crc32c and pubkeys (the key pubkey).
+    """
+    i, key_file = position_and_path
+
+    #Get the name of the secret only
+    key_file_name = upload_util.get_secret_name(key_file)
+
+    # Create secret if does not exist
+    exists = upload_util.create_secret_if_not_exists(client, project_id, key_file_name,
+                                                       existing_secrets)
+
+    # Read contents of json into str and pass to bytes
+    with open(key_file.path, 'r', encoding="utf-8") as f:
+        contents = f.read()
+        f.close()
+    payload_bytes = contents.encode("utf-8")
+    key_index = key_file.index
+    pubkey = json.loads(contents)["pubkey"]
+
+    print(f"\t[{green}✓{end}] Read file {key_file_name} - {i}/{total}")
+
+    # Skip version update if skip is set
+    if skip and exists:
+        print("\t\t[-] Skipping version update of existing secret.")
+        return {"secret_name": key_file_name, "low_index": key_index, "high_index": key_index,
+                "version": None, "crc32c": None, "pubkeys": pubkey}
+
+    # Add secret version
+    version = upload_util.add_secret_version(client, project_id, key_file_name, payload_bytes)
+
+    # Verify checksums if not optimistic
+    if not optimistic:
+        if upload_util.verify_version(client, version, payload_bytes, checksum_mode):
+            print(f"\t[{green}✓{end}] Matching checksums of secret manager and local data.")
+        else:
+            print(f"\t[{red}x{end}] Data corruption detected. Panicing.")
+            exit(1)
+
+    # Store the keystore hash for 'secrets sync'
+    upload_util.set_secret_sha256(client, project_id, key_file_name, payload_bytes)
+
+    return {"secret_name": key_file_name, "low_index": key_index, "high_index": key_index,
+            "version": version.name, "crc32c": util.get_crc32c(payload_bytes), "pubkeys": pubkey}
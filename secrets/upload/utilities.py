@@ -1,38 +1,48 @@
 """Utilities for the create subcommand on secrets command"""
 import os
+import sys
 import hashlib
-import glob
 
+import secrets.utilities as util
+import keystores.scanner as scanner
+
+from google.api_core import exceptions
 from google.cloud import secretmanager
-from cli.pretty.colors import red, end
+from cli.pretty.colors import red, end, yellow
 
 
 def create_secret_if_not_exists(secret_manager_client:secretmanager.SecretManagerServiceClient,
-                                project_id:str, secret_id:str) -> bool:
-    """Checks if a given secret exists and creates one if not
+                                project_id:str, secret_id:str, existing_secrets: set) -> bool:
+    """Checks if a given secret exists and creates one if not.
+    Existence is decided on a snapshot of the project secret names taken before the upload,
+    so no call is made for secrets that already exist.
     
     Args:
         secret_manager_client: The secret manager client
         project_id: The project id
         secret_id: The secret name
+        existing_secrets: Set of secret names in the project from util.list_secret_names
     Returns:
         True if the secret exists.
         False if it was created.
 
     """
-    secret_name = secret_manager_client.secret_path(project_id, secret_id)
-    try:
-        secret_manager_client.get_secret(request={"name": secret_name})
+    if secret_id in existing_secrets:
         return True
-    except Exception as _: #pylint: disable=W0718
+
+    try:
         #Create empty secret
-        secret_manager_client.create_secret(request={
+        util.call_secret_manager("write", secret_manager_client.create_secret, {
             "parent": f"projects/{project_id}",
             "secret_id": secret_id,
             "secret": {"replication": {"automatic": {}}},
         })
         return False
 
+    #? The secret was created after the snapshot was taken, by another run or upload wave.
+    except exceptions.AlreadyExists:
+        return True
+
 def save_validator_pubkey_and_name(secret_names_to_pubkeys:dict, output:str):
     """
     Saves the validator pubkeys and secret names locally for records.
@@ -47,6 +57,7 @@ def save_validator_pubkey_and_name(secret_names_to_pubkeys:dict, output:str):
     pk_path = os.path.join(output, "public_keys.txt")
     sn_path = os.path.join(output, "secret_names.txt")
     pksn_path = os.path.join(output, "secret_names_to_pubkeys.txt")
+    index_path = os.path.join(output, util.PUBKEY_INDEX_FILE_NAME)
  
     # Write files
     with open(pk_path, "w", encoding="utf-8") as pf, open(sn_path, "w", encoding="utf-8") as nf, open(pksn_path, "w", encoding="utf-8") as ptnf:
@@ -58,33 +69,221 @@ def save_validator_pubkey_and_name(secret_names_to_pubkeys:dict, output:str):
         nf.close()
         ptnf.close()
 
+    # Write the pubkey index for 'secrets get --pubkey'
+    #? Each line is <pubkey> <secret_name> <position>, where position is the line of the key in a
+    #? fat secret. Single secrets hold one key, at position 0.
+    with open(index_path, "w", encoding="utf-8") as f:
+        for secret_name, pubkeys in secret_names_to_pubkeys.items():
+            pubkeys = pubkeys if isinstance(pubkeys, list) else [pubkeys]
+            for position, pubkey in enumerate(pubkeys):
+                f.write(f"{pubkey} {secret_name} {position}\n")
+        f.close()
+
+def set_secret_sha256(client: secretmanager.SecretManagerServiceClient, project_id: str,
+                      secret_id: str, payload_bytes: bytes):
+    """
+    Stores the SHA256 of the payload in the secret annotations, so 'secrets sync' and
+    'secrets audit' can tell whether the keystores changed without reading the secret.
+    #? Call it only after the version is added. A secret with a matching annotation is
+    #? considered up to date, so the hash isn't set in the create request of new secrets:
+    #? a run killed before the version is added would leave an empty secret that looks synced.
+
+    Args:
+        client: the Secret manager client
+        project_id: The project id
+        secret_id: The secret name
+        payload_bytes: The payload of the latest version. Decoded for fat secrets.
+    """
+    util.call_secret_manager("write", client.update_secret, {
+        "secret": {
+            "name": client.secret_path(project_id, secret_id),
+            "annotations": {util.SHA256_ANNOTATION: hashlib.sha256(payload_bytes).hexdigest()},
+        },
+        "update_mask": {"paths": ["annotations"]},
+    })
+
+def update_catalog(client: secretmanager.SecretManagerServiceClient, project_id: str,
+                   entries: list, existing_secrets: set):
+    """
+    Adds the fat secrets of an upload to the catalog secret, creating it if needed.
+    Catalog rows of previous uploads are kept, except those overlapping the new secrets, which
+    they replace. Rows added by concurrent uploads are kept too.
+
+    Args:
+        client: the Secret manager client
+        project_id: The project id
+        entries: Journal entries of the fat secrets of the upload
+        existing_secrets: Snapshot of the secret names in the project taken before the upload
+    """
+    # Read the current catalog
+    base_number, base_rows = 0, []
+    if util.CATALOG_SECRET_NAME in existing_secrets:
+        base_number, base_rows = read_catalog_version(client, project_id, "latest")
+
+    # Replace the rows overlapping the new secrets
+    #? Only the version number is kept, the rest of the version name is implied by the secret.
+    new_rows = [(e["low_index"], e["high_index"], e["secret_name"], e["version"].rsplit("/", 1)[-1])
+                for e in entries]
+    rows = merge_catalog_rows(base_rows, new_rows)
+    create_secret_if_not_exists(client, project_id, util.CATALOG_SECRET_NAME, existing_secrets)
+
+    #? Secret Manager has no precondition on add_secret_version, so concurrent uploads are caught
+    #? after the write: the new version must directly follow the last one read. Otherwise the rows
+    #? added by the versions in between are merged and the catalog is written again.
+    last_number, base_set = base_number, set(base_rows)
+    while True:
+        version = add_secret_version(client, project_id, util.CATALOG_SECRET_NAME, encode_catalog(rows))
+        number = int(version.name.rsplit("/", 1)[-1])
+        if number == last_number + 1:
+            return
+
+        print(f"\t[{yellow}WARN{end}] Another upload updated the '{util.CATALOG_SECRET_NAME}' catalog. Merging its rows.")
+        for other_number in range(last_number + 1, number):
+            _, other_rows = read_catalog_version(client, project_id, str(other_number))
+            rows = merge_catalog_rows(rows, [row for row in other_rows if row not in base_set])
+        rows = merge_catalog_rows(rows, new_rows)
+        last_number = number
+
+def read_catalog_version(client: secretmanager.SecretManagerServiceClient, project_id: str,
+                         version: str) -> tuple:
+    """
+    Reads a version of the catalog secret.
+
+    Args:
+        client: the Secret manager client
+        project_id: The project id
+        version: The version number, or 'latest'
+
+    Returns: A tuple int:version number, list:catalog rows. No rows if the version doesn't exist,
+        and version number 0 if the catalog has no version.
+    """
+    name = f"projects/{project_id}/secrets/{util.CATALOG_SECRET_NAME}/versions/{version}"
+    try:
+        response = util.call_secret_manager("access", client.access_secret_version, {"name": name})
+
+    #? Destroyed versions can't be read, and their rows are superseded by the newer versions.
+    except (exceptions.NotFound, exceptions.FailedPrecondition):
+        return (0 if version == "latest" else int(version)), []
+
+    return int(response.name.rsplit("/", 1)[-1]), util.parse_catalog(util.decode_payload(response.payload.data))
+
+def merge_catalog_rows(rows: list, new_rows: list) -> list:
+    """Returns the catalog rows with the new rows replacing the rows whose ranges overlap them"""
+    return [row for row in rows
+            if not any(row[0] <= high and low <= row[1] for low, high, _, _ in new_rows)] + new_rows
+
+def encode_catalog(rows: list) -> bytes:
+    """Encodes the catalog rows in the zlib fat format"""
+    #? Rows compress well, which keeps catalogs of around a million keys within the 64kb limit.
+    compressor = util.new_fat_compressor()
+    return util.FAT_FORMAT_ZLIB + compressor.compress(util.format_catalog(rows).encode("utf-8")) + compressor.flush()
+
+def open_journal(output_dir: str, resume: bool) -> tuple:
+    """
+    Opens the append-only upload journal in output_dir. Every committed secret gets a line in
+    the journal as soon as it completes, so an interrupted upload can be resumed.
+    When resuming, the committed entries are read back and a truncated last line left by a
+    crash is dropped. Otherwise the journal starts empty.
+
+    Args:
+        output_dir: Chosen output directory in the config.
+        resume: Whether to keep the entries of a previous run.
+
+    Returns: A tuple file:journal opened for appending, list:committed journal entries
+    """
+    journal_path = os.path.join(output_dir, "upload_journal.jsonl")
+    return util.open_record_file(journal_path, resume, "journal")
+
+def append_to_journal(journal, entry: dict):
+    """
+    Appends a committed secret to the upload journal and syncs it to disk right away.
+
+    Args:
+        journal: The journal file from open_journal
+        entry: Dict with the secret_name, low_index, high_index, version, crc32c and pubkeys
+            of the committed secret.
+    """
+    util.append_record(journal, entry)
+
+def get_committed_indexes(entries: list) -> set:
+    """Returns the set of all the key indexes covered by the journal entries"""
+    committed = set()
+    for entry in entries:
+        committed.update(range(entry["low_index"], entry["high_index"] + 1))
+    return committed
+
+def add_secret_version(client: secretmanager.SecretManagerServiceClient, project_id: str,
+                       secret_id: str, payload_bytes: bytes) -> secretmanager.SecretVersion:
+    """
+    Adds a new version to the secret, sending the CRC32C checksum of the payload along with it.
+    Secret Manager recomputes the checksum on write and rejects the version if it doesn't match.
+    #? Not retried when the service is unavailable, as a retry after a lost response would add a
+    #? duplicate version. The failed key is uploaded again by a resumed run.
+
+    Args:
+        client: the Secret manager client
+        project_id: The project id
+        secret_id: The secret name
+        payload_bytes: The payload of the new version
+
+    Returns: The created secret version.
+    """
+    request={"parent": f"projects/{project_id}/secrets/{secret_id}",
+             "payload": {"data": payload_bytes, "data_crc32c": util.get_crc32c(payload_bytes)}}
+    return util.call_secret_manager("write", client.add_secret_version, request, idempotent=False)
+
+def verify_version(client: secretmanager.SecretManagerServiceClient,
+                   version: secretmanager.SecretVersion,
+                   payload_bytes: bytes, checksum_mode: str) -> bool:
+    """
+    Verifies the integrity of a created version with the chosen checksum mode.
+        - crc32c: Checks that Secret Manager validated the CRC32C sent with the payload.
+            No extra calls and no 'secretmanager.versions.access' permission needed.
+        - sha256: Reads the version back and compares the SHA256 of both payloads.
+
+    Returns: True if the version verifies, False otherwise
+    """
+    if checksum_mode == "sha256":
+        return verify_payload(client, version, payload_bytes)
+    return verify_crc32c(version)
+
+def verify_crc32c(version: secretmanager.SecretVersion) -> bool:
+    """
+    Verifies that Secret Manager received and validated the client side CRC32C of the version.
+    #? A version whose payload doesn't match the data_crc32c is rejected by the API on write,
+    #? so a created version flagged with client_specified_payload_checksum is verified.
+
+    Returns: True if the checksum was validated, False otherwise
+    """
+    return bool(version.client_specified_payload_checksum)
+
 def verify_payload(client: secretmanager.SecretManagerServiceClient,
                    version: secretmanager.SecretVersion,
-                   contents: str) -> bool:
+                   payload_bytes: bytes) -> bool:
     """
-    Verifies the sha256 checkcsum of the contents string, compared
+    Verifies the sha256 checkcsum of the payload bytes, compared
     to the hash of the created secret.
     Args:
         client: the Secret manager client
         version: the Secret version getting checked against
-        contents: the contents of the validator keystore to be checked against
-            the secret.
+        payload_bytes: the payload sent to the secret version, either the contents of the
+            validator keystore or an encoded fat payload.
     
     Returns: True if checksum matches, False otherwise
     """
 
-    #Get string sha256
-    str_sha256 = hashlib.sha256(contents.encode())
+    #Get local payload sha256
+    local_sha256 = hashlib.sha256(payload_bytes)
     
     #Access the secret version and verify payload SHA256
-    response = client.access_secret_version(request={"name": version.name})
+    response = util.call_secret_manager("access", client.access_secret_version, {"name": version.name})
 
     #Get payload sha256
-    payload = response.payload.data.decode("UTF-8")
-    payload_sha256 = hashlib.sha256(payload.encode())
+    #? Compared on the raw bytes so that compressed fat payloads verify too.
+    payload_sha256 = hashlib.sha256(response.payload.data)
 
     #If checksum verifies
-    if str_sha256.digest() == payload_sha256.digest():
+    if local_sha256.digest() == payload_sha256.digest():
         return True
     return False
 
@@ -95,21 +294,22 @@ def get_keyfiles(key_directory_path: str) -> list:
     See https://eips.ethereum.org/EIPS/eip-2334
     https://github.com/ethereum/staking-deposit-cli/blob/master/staking_deposit/credentials.py#L155
     
-    Returns a sorted list of these keystores based on the key index in the file name (that is
-    i in  keystore-m_12381_3600_i_0_0-<timestamp>.json)
+    Returns a list of scanner.KeystoreFile records (index, timestamp, path) sorted by the key
+    index in the file name (that is i in  keystore-m_12381_3600_i_0_0-<timestamp>.json)
+    It exits if it does not find any files.
     """
-    # Set the filename desired format and filter with glob
+    # Scan the directory for keystores
     desired_format = "keystore-m_12381_3600_*_0_0-*.json"
-    matching_files = glob.glob(os.path.join(key_directory_path, desired_format))
+    key_files = scanner.scan_keystores(key_directory_path)
 
     # Verify that there exists keystores matching the format
-    if len(matching_files) == 0:
+    if len(key_files) == 0:
         print(f"\n{red}[ERROR]{end} No keys matching the keystore naming format found.",
               f"\n\tExpected format is {desired_format}. See README.md for more details.")
-        return
+        sys.exit(1)
 
-    # Get all filenames paths sorted by index
-    #? Sorts by i in /full/path/to/keystore-m_12381_3600_i_0_0-timestamp.json
-    file_names = sorted(matching_files, key=lambda x: int(x.split("_")[-3]))
-    
-    return file_names
+    return key_files
+
+def get_secret_name(key_file: scanner.KeystoreFile) -> str:
+    """Returns the single secret name of a keystore file. That is its file name without '.json'"""
+    return f"keystore-m_12381_3600_{key_file.index}_0_0-{key_file.timestamp}"
@@ -1,15 +1,335 @@
 """Utilities for the secrets command"""
 
+import os
 import re
 import sys
 import json
+import time
+import zlib
+import random
+import threading
+import collections
+import concurrent.futures
 
+import google_crc32c
 import google.cloud.secretmanager as secretmanager
 
+from google.api_core import exceptions
+from cli.pretty.colors import yellow, end
+
+# Secret Manager default per project quotas, in requests per second
+#? https://cloud.google.com/secret-manager/quotas
+#? access: access_secret_version - 90000/min. read: list and get calls - 600/min.
+#? write: create, update, delete and add version calls - 600/min.
+SM_QUOTAS = {"access": 90000 / 60, "read": 600 / 60, "write": 600 / 60}
+
+# Retry settings for throttled or unavailable calls
+SM_MAX_RETRIES = 8
+SM_BACKOFF_BASE = 1 #? Seconds
+SM_BACKOFF_CAP = 60 #? Seconds
+
+# Adaptive limit of Secret Manager calls in flight across all workers
+#? Additive increase after a window of successful calls, halved on every RESOURCE_EXHAUSTED.
+SM_MAX_IN_FLIGHT = 1024
+
+#? Shared state of the token buckets and the in flight limit. Guarded by _sm_lock.
+_sm_lock = threading.Condition(threading.RLock())
+_sm_buckets = {quota: {"tokens": rate, "refilled": time.monotonic()} for quota, rate in SM_QUOTAS.items()}
+_sm_in_flight = {"limit": SM_MAX_IN_FLIGHT, "calls": 0, "successes": 0}
+
+# Annotation holding the SHA256 of the keystore stored in a single secret
+#? Labels can't hold the 64 hex characters of a SHA256, annotations can.
+SHA256_ANNOTATION = "keyman-sha256"
+
+# Catalog of the fat secrets, kept up to date by 'upload' so range gets skip the listing
+#? Its payload is a zlib fat payload of 'low,high,secret_name,version' lines sorted by low index.
+#? The name doesn't match the key-index_l_to_h pattern of the fat secrets.
+CATALOG_SECRET_NAME = "keyman-fat-catalog"
+
+# Local index of the uploaded pubkeys, written to the output directory by 'upload'
+#? Read by 'get --pubkey' to find the secret and line holding every key.
+PUBKEY_INDEX_FILE_NAME = "pubkey_index.txt"
+
+# Name of the secrets created in 'single' mode
+SINGLE_SECRET_PATTERN = r'^keystore-m_12381_3600_\d+_0_0-\d+$'
+
+# Name of the secrets created in 'fat' mode
+FAT_SECRET_PATTERN = r'^key-index_(\d+)_to_(\d+)$'
+
+# Key index in the 'path' field of an EIP-2335 keystore, as in m/12381/3600/i/0/0
+KEYSTORE_PATH_PATTERN = re.compile(r'"path"\s*:\s*"m/12381/3600/(\d+)/0/0"')
+
+# Secret listing
+#? 25000 is the largest page size allowed by list_secrets.
+SM_LIST_PAGE_SIZE = 25000
+SM_REGEX_SPECIAL_CHARS = ".^$*+?{}[]\\|()"
+
+# Secret versions that still hold a payload, and are billed
+SM_ACTIVE_VERSIONS_FILTER = "state:(ENABLED OR DISABLED)"
+
+# Fat secret payload formats
+#? 'plain' payloads have no header and are newline separated <index>:<timestamp>:<secret> lines.
+#? The key index prefix lets readers slice ranges without parsing the keystore JSON.
+#? Secrets uploaded before the prefix was added hold <timestamp>:<secret> lines, see split_fat_line.
+#? 'zlib' payloads start with FAT_FORMAT_ZLIB followed by the zlib stream of the same lines.
+#? A plain payload always starts with a timestamp digit, so it never collides with a header byte.
+FAT_FORMAT_ZLIB = b"\x01"
+
+#? Preset dictionary for the zlib fat format, built from the fields and parameters every
+#? EIP-2335 keystore written by the deposit cli shares. Most frequent strings go last.
+#? https://eips.ethereum.org/EIPS/eip-2335
+#! Never change this value, existing zlib fat secrets can only be decompressed with it.
+FAT_ZLIB_DICTIONARY = (
+    '{"function": "pbkdf2", "params": {"dklen": 32, "c": 262144, "prf": "hmac-sha256", "salt": "'
+    '{"crypto": {"kdf": {"function": "scrypt", "params": {"dklen": 32, "n": 262144, "r": 8, "p": 1, "salt": "'
+    '"}, "message": ""}, "checksum": {"function": "sha256", "params": {}, "message": "'
+    '"}, "cipher": {"function": "aes-128-ctr", "params": {"iv": "'
+    '"}, "message": "'
+    '"}}, "description": "", "pubkey": "'
+    '", "path": "m/12381/3600/'
+    '/0/0", "uuid": "'
+    '", "version": 4}\n'
+).encode("utf-8")
+
 def create_sm_client() -> secretmanager.SecretManagerServiceClient:
     """Creates and returns a Google Cloud Secret Manager Client with ADC"""
     return secretmanager.SecretManagerServiceClient()
 
+def map_concurrently(func, items, concurrency: int):
+    """
+    Applies func to every item over a bounded thread pool and yields the results in the same
+    order as the items. The items are consumed lazily, so only a small window of work is in
+    flight at any time.
+    A concurrency of 1 runs everything serially on the calling thread.
+
+    Args:
+        func: A callable taking a single item.
+        items: An iterable of items to process.
+        concurrency: The maximum number of worker threads.
+    Returns: A generator of results in item order.
+    """
+    if concurrency <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    #? The Secret Manager client is thread safe, so workers can share a single client.
+    #? Pending futures are bounded to twice the pool size to keep memory flat on large runs.
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+    pending = collections.deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= concurrency * 2:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+    # Cancel queued work if a worker fails or the caller stops early
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def call_secret_manager(quota: str, rpc, request: dict, idempotent: bool = True):
+    """
+    Runs a Secret Manager call within the project quotas, retrying it when it gets throttled
+    (RESOURCE_EXHAUSTED) or the service is unavailable (UNAVAILABLE).
+        1. Waits for a token of the quota bucket the call counts against.
+        2. Waits for a slot under the adaptive in flight limit.
+        3. Retries failed calls with jittered exponential backoff.
+    Every Secret Manager call goes through here, so parallel modes run close to the quota
+    ceiling without tripping it.
+    #? List calls return a pager that fetches the following pages outside of this wrapper.
+    #? Use list_pages for them.
+
+    Args:
+        quota: The quota the call counts against. 'access', 'read' or 'write'.
+        rpc: The client method to call. For example client.add_secret_version.
+        request: The request of the call.
+        idempotent: False for calls that must not run twice, like add_secret_version. They are
+            only retried when throttled, as UNAVAILABLE can hide a call that was applied.
+    Returns: The response of the call.
+    """
+    attempt = 0
+    while True:
+        acquire_quota_token(quota)
+        acquire_call_slot()
+        throttled = False
+        try:
+            return rpc(request=request)
+
+        except (exceptions.ResourceExhausted, exceptions.ServiceUnavailable) as error:
+            throttled = isinstance(error, exceptions.ResourceExhausted)
+            if attempt >= SM_MAX_RETRIES or not (throttled or idempotent):
+                raise
+
+        finally:
+            release_call_slot(throttled)
+
+        # Back off with full jitter before retrying
+        time.sleep(get_backoff_delay(rpc, attempt, throttled))
+        attempt += 1
+
+def get_backoff_delay(rpc, attempt: int, throttled: bool) -> float:
+    """Returns the full jitter exponential backoff delay before retrying a failed call, and logs it"""
+    delay = random.uniform(0, min(SM_BACKOFF_CAP, SM_BACKOFF_BASE * 2 ** attempt))
+    reason = "Throttled" if throttled else "Service unavailable"
+    print(f"\t[{yellow}WARN{end}] {reason} on {rpc.__name__}. Retrying in {round(delay, 2)}s",
+          f"- {attempt + 1}/{SM_MAX_RETRIES}")
+    return delay
+
+def acquire_quota_token(quota: str):
+    """Blocks until the token bucket of the quota has a token and takes it"""
+    wait = take_quota_token(quota)
+    while wait:
+        time.sleep(wait)
+        wait = take_quota_token(quota)
+
+def take_quota_token(quota: str) -> float:
+    """
+    Takes a token from the bucket of the quota if there is one.
+
+    Returns: 0 if the token was taken, else the seconds to wait for the next token.
+    """
+    rate = SM_QUOTAS[quota]
+    bucket = _sm_buckets[quota]
+    with _sm_lock:
+        # Refill the bucket, holding at most one second of calls
+        now = time.monotonic()
+        bucket["tokens"] = min(rate, bucket["tokens"] + (now - bucket["refilled"]) * rate)
+        bucket["refilled"] = now
+
+        if bucket["tokens"] >= 1:
+            bucket["tokens"] -= 1
+            return 0
+        return (1 - bucket["tokens"]) / rate
+
+def acquire_call_slot():
+    """Blocks until the number of calls in flight is under the adaptive limit and takes a slot"""
+    with _sm_lock:
+        while not take_call_slot():
+            _sm_lock.wait()
+
+def take_call_slot() -> bool:
+    """Takes a call slot if the number of calls in flight is under the adaptive limit"""
+    with _sm_lock:
+        if _sm_in_flight["calls"] >= _sm_in_flight["limit"]:
+            return False
+        _sm_in_flight["calls"] += 1
+        return True
+
+def release_call_slot(throttled: bool):
+    """
+    Releases a call slot and adapts the in flight limit (AIMD).
+    A throttled call halves the limit. A full window of successful calls raises it by one.
+    """
+    with _sm_lock:
+        _sm_in_flight["calls"] -= 1
+        if throttled:
+            _sm_in_flight["limit"] = max(1, _sm_in_flight["limit"] // 2)
+            _sm_in_flight["successes"] = 0
+        else:
+            _sm_in_flight["successes"] += 1
+            if _sm_in_flight["successes"] >= _sm_in_flight["limit"]:
+                _sm_in_flight["limit"] = min(SM_MAX_IN_FLIGHT, _sm_in_flight["limit"] + 1)
+                _sm_in_flight["successes"] = 0
+        _sm_lock.notify_all()
+
+def open_record_file(path: str, resume: bool, description: str) -> tuple:
+    """
+    Opens an append-only JSON lines record file, like the upload journal. When resuming, the
+    entries of the previous run are read back and a truncated last line left by a crash is dropped.
+    Otherwise the file starts empty.
+    #? The valid entries are written to a temporary file that replaces the record atomically, so a
+    #? crash while resuming never loses the entries of the previous run.
+
+    Args:
+        path: Path of the record file.
+        resume: Whether to keep the entries of a previous run.
+        description: Name of the record in the warnings. For example 'journal'.
+
+    Returns: A tuple file:record opened for appending, list:entries of the previous run
+    """
+    entries = []
+
+    # Read the entries of the previous run
+    if resume and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    print(f"[{yellow}WARN{end}] Ignoring incomplete {description} entry '{line.strip()}'.")
+            f.close()
+
+    # Replace the record with the valid entries only
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(f"{json.dumps(entry)}\n")
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+    os.replace(f"{path}.tmp", path)
+
+    return open(path, "a", encoding="utf-8"), entries #pylint: disable=R1732
+
+def append_record(record, entry: dict):
+    """
+    Appends an entry to a record file from open_record_file and syncs it to disk right away,
+    so an entry that was written survives a crash or a power loss.
+
+    Args:
+        record: The record file from open_record_file
+        entry: The JSON serializable entry.
+    """
+    record.write(f"{json.dumps(entry)}\n")
+    record.flush()
+    os.fsync(record.fileno())
+
+def get_crc32c(data: bytes) -> int:
+    """Returns the CRC32C checksum of the data as an int, as expected by Secret Manager payloads"""
+    return google_crc32c.value(data)
+
+def new_fat_compressor():
+    """Returns a zlib compressor for the zlib fat format, primed with the keystore dictionary"""
+    return zlib.compressobj(level=9, zdict=FAT_ZLIB_DICTIONARY)
+
+def sort_versions(version_names: list) -> list:
+    """Sorts secret version names newest first by their version number"""
+    #? The version name is projects/<project>/secrets/<secret>/versions/<version>
+    return sorted(version_names, key=lambda name: int(name.split("/")[-1]), reverse=True)
+
+def decode_payload(data: bytes) -> str:
+    """
+    Decodes the payload of a secret version into its string contents.
+    Detects the fat format from the header byte, so it works for plain and zlib fat secrets
+    as well as for single secrets.
+
+    Args:
+        data: The raw payload data of the secret version.
+    Returns: The string contents of the secret.
+    """
+    if data[:1] == FAT_FORMAT_ZLIB:
+        data = zlib.decompressobj(zdict=FAT_ZLIB_DICTIONARY).decompress(data[1:])
+    return data.decode("UTF-8")
+
+def parse_catalog(raw: str) -> list:
+    """
+    Parses the payload of the catalog secret.
+
+    Returns: A list of tuples (int:low, int:high, str:secret_name, str:version) sorted by low index.
+    """
+    rows = []
+    for line in raw.strip().split("\n"):
+        if line:
+            low, high, secret_name, version = line.split(",")
+            rows.append((int(low), int(high), secret_name, version))
+    return sorted(rows)
+
+def format_catalog(rows: list) -> str:
+    """Builds the payload of the catalog secret from a list of (low, high, secret_name, version) tuples"""
+    return "".join(f"{low},{high},{secret_name},{version}\n" for low, high, secret_name, version in sorted(rows))
+
 def get_key_index(key: dict, mode: str) -> int:
     """
     Returns the key index for a given keystore payload or file name compliant with:
@@ -32,41 +352,163 @@ def get_secret_timestamp_and_value(key_string: str) -> tuple:
     Returns the key timestamp and the secret value for a given keystore string
 
     Args:
-        - key-string: A key string in the format <timestamp>:<secret>,
-            where the <secret> is a JSON string.
+        - key-string: A key string in the format <timestamp>:<secret> or
+            <index>:<timestamp>:<secret>, where the <secret> is a JSON string.
     Returns: A tuple str:timestamp, dict:secret_value
     """
-    buff = key_string.split(":", 1)
+    _, timestamp, secret = split_fat_line(key_string)
+    return timestamp, json.loads(secret)
 
-    if len(buff) != 2:
-        print(f"[PANIC] Invalid key string {key_string}. Format shoud be <timestamp>:<secret>.")
+def split_fat_line(key_string: str) -> tuple:
+    """
+    Splits a fat secret line into its key index, timestamp and secret, without parsing the secret.
+    Lines in the <timestamp>:<secret> format of older secrets have no key index.
 
-    secret_value = json.loads(buff[1])
-    timestamp = buff[0]
-    return timestamp, secret_value
+    Args:
+        - key-string: A key string in the format <index>:<timestamp>:<secret> or <timestamp>:<secret>
+    Returns: A tuple int:key_index or None, str:timestamp, str:secret
+    """
+    buff = key_string.split(":", 2)
 
-def get_secret_names_matching_pattern(client: secretmanager.SecretManagerServiceClient,
-                                      project_id: str, pattern: str) -> list:
+    if len(buff) < 2:
+        print(f"[PANIC] Invalid key string {key_string}. Format shoud be <index>:<timestamp>:<secret>.")
+        sys.exit(1)
+
+    # Lines without a key index
+    #? The secret is a JSON object, so it never starts with a digit like a timestamp does.
+    if len(buff) == 2 or not buff[1].isdigit():
+        return None, buff[0], key_string.split(":", 1)[1]
+
+    return int(buff[0]), buff[1], buff[2]
+
+def get_line_key_index(key_string: str) -> int:
+    """
+    Returns the key index of a fat secret line. Reads the index prefix, and for lines of older
+    secrets without one, finds the keystore 'path' field without parsing the whole JSON.
     """
-    Gets a list of secret names matchign the provided pattern.
+    key_index, _, secret = split_fat_line(key_string)
+    if key_index is not None:
+        return key_index
+
+    #? Keystores not written by the deposit cli may lay the field out differently, so they are parsed.
+    match = KEYSTORE_PATH_PATTERN.search(secret)
+    if match:
+        return int(match.group(1))
+    return get_key_index(json.loads(secret), "keystore")
+
+def list_secret_names(client: secretmanager.SecretManagerServiceClient, project_id: str,
+                      name_filter: str = "") -> set:
+    """
+    Takes a snapshot of the secret names in the project with a paged list_secrets call.
 
     Args:
-        project-id: The Google Cloud Project ID from where to fetch secrets
-        pattern: A regex string pattern to check against.
+        client: A Google Cloud secret manager client.
+        project_id: The Google Cloud Project ID from where to list secrets
+        name_filter: Optional list_secrets filter, for example from get_name_filter.
     
-    Returns: A list of secret names.
+    Returns: A set of secret names.
     """
-    matching_secrets = []
+    return set(list_secrets(client, project_id, name_filter, lambda secret: secret.name.split("/")[-1]))
 
-    # Build the parent and pattern
-    parent = f"projects/{project_id}"
+def list_secrets(client: secretmanager.SecretManagerServiceClient, project_id: str,
+                 name_filter: str, transform):
+    """
+    Streams the secrets in the project matching a server-side filter, page by page.
 
-    # Get the raw secret names
-    raw_secret_names = client.list_secrets(request={"parent": parent})
+    Args:
+        client: A Google Cloud secret manager client.
+        project_id: The Google Cloud Project ID from where to list secrets
+        name_filter: list_secrets filter. An empty filter lists every secret.
+        transform: Callable applied to every listed secret.
+    
+    Returns: A generator of the transformed secrets.
+    """
+    request = {"parent": f"projects/{project_id}", "page_size": SM_LIST_PAGE_SIZE}
+    if name_filter:
+        request["filter"] = name_filter
+    for secret in list_pages(client.list_secrets, request, "secrets"):
+        yield transform(secret)
 
-    for secret in raw_secret_names:
-        secret = secret.name.split("/")[-1] #Get only the secret name
-        if re.match(pattern, secret):
-            matching_secrets.append(secret)
+def list_pages(rpc, request: dict, field: str):
+    """
+    Streams the items of a Secret Manager list call, fetching one page at a time.
+    Every page is a separate call_secret_manager call against the read quota, so long listings
+    are paced and retried like any other call.
+
+    Args:
+        rpc: The client list method. For example client.list_secret_versions.
+        request: The request of the first page.
+        field: The repeated field of the response holding the items. For example 'versions'.
+
+    Returns: A generator of the listed items, yielded as pages arrive.
+    """
+    request = dict(request)
+    while True:
+        #? Iterating the pager would fetch the next pages outside of the wrapper, so only the
+        #? fields of the current page are read.
+        page = call_secret_manager("read", rpc, request)
+        yield from getattr(page, field)
+        if not page.next_page_token:
+            return
+        request["page_token"] = page.next_page_token
+
+def get_name_filter(*prefixes: str) -> str:
+    """
+    Builds a list_secrets filter matching the secret names containing any of the prefixes.
+    Prefixes can be regex patterns, in which case their leading literal characters are used.
+
+    Returns: The filter string, or an empty string if any pattern has no literal prefix.
+    """
+    terms = []
+    for prefix in prefixes:
+        literal = get_literal_prefix(prefix)
+        if not literal:
+            return ""
+        terms.append(f'name:"{literal}"')
+    return " OR ".join(terms)
 
-    return matching_secrets
+def get_literal_prefix(pattern: str) -> str:
+    """
+    Returns the leading literal characters every string matched by the regex pattern starts with.
+    Returns an empty string if the pattern has alternations at the top level.
+    """
+    # Alternations could match strings without the prefix
+    #? Alternations within groups come after the literal prefix, so they are safe.
+    depth = 0
+    for i, char in enumerate(pattern):
+        if char == "(" and (i == 0 or pattern[i-1] != "\\"):
+            depth += 1
+        elif char == ")" and pattern[i-1] != "\\":
+            depth -= 1
+        elif char == "|" and depth == 0 and pattern[i-1] != "\\":
+            return ""
+
+    # Take the characters up to the first special one
+    literal = ""
+    for char in pattern.lstrip("^"):
+        if char in SM_REGEX_SPECIAL_CHARS:
+            # A quantifier makes the previous character optional
+            if char in "*?{":
+                literal = literal[:-1]
+            break
+        literal += char
+    return literal
+
+def get_secret_names_matching_pattern(client: secretmanager.SecretManagerServiceClient,
+                                      project_id: str, pattern: str):
+    """
+    Streams the secret names matchign the provided pattern.
+    The literal prefix of the pattern is sent as a list_secrets filter, so only the secrets
+    containing it are listed, and the pattern is checked locally on those.
+
+    Args:
+        project-id: The Google Cloud Project ID from where to fetch secrets
+        pattern: A regex string pattern to check against.
+    
+    Returns: A generator of secret names.
+    """
+    secret_names = list_secrets(client, project_id, get_name_filter(pattern),
+                                lambda secret: secret.name.split("/")[-1]) # Get only the secret name
+    for secret in secret_names:
+        if re.match(pattern, secret):
+            yield secret
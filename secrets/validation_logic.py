@@ -1,5 +1,6 @@
 """ Gets and Validates module-level settings for the upload command """
 import os
+import sys
 import json
 import re
 
@@ -25,8 +26,8 @@ def validate_env_variables(project_id: str, key_directory_path: str, google_adc:
     """
         Runs the validation logic for the env params depending on the command.
         Validates the Google Project ID and google ADC for all.
-        Validates the output directory for 'get'
-        Validates output dir and key path for 'upload' 
+        Validates the output directory for 'get' and 'delete'
+        Validates output dir and key path for 'upload', 'sync' and 'audit'
     """
 
     # Project Id
@@ -44,8 +45,8 @@ def validate_env_variables(project_id: str, key_directory_path: str, google_adc:
                 "\nPlease create an ADC file. See the README for how to do this.")
         return False
 
-    # delete command doesn't need the subsequent validations
-    if subcommand == "delete":
+    # prune command doesn't need the subsequent validations
+    if subcommand == "prune":
         return True
 
     # Output Dir
@@ -53,8 +54,8 @@ def validate_env_variables(project_id: str, key_directory_path: str, google_adc:
         print(f"\n{red}[ERROR]{end} Output directory not found.\nPlease add the path to the .env file.")
         return False
 
-    # get command doesn't need the subsequent validations
-    if subcommand == "get":
+    # get and delete commands don't need the subsequent validations
+    if subcommand in ("get", "delete"):
         return True
 
     # Project keys
@@ -68,6 +69,19 @@ def validate_env_variables(project_id: str, key_directory_path: str, google_adc:
 
     return True
 
+def validate_concurrency(flag_head: str, value: str) -> int:
+    """
+    Validates the value of a concurrency flag. Exits without returning upon invalid values.
+
+    Returns: The number of concurrent workers as an int.
+    """
+    if not value.isnumeric() or int(value) < 1:
+        print(f"\n{red}[ERROR]{end} Invalid value '{bold}{value}{end}' for flag '{yellow}{flag_head}{end}'.",
+              "Please enter a positive integer.")
+        sys.exit(1)
+
+    return int(value)
+
 def validate_proj_id(s:str) -> bool:
     """Validates the format of a project ID in ^[a-z][a-z0-9-]*[a-z0-9]$"""
     pattern = "^[a-z][a-z0-9-]*[a-z0-9]$"
@@ -0,0 +1 @@
+"""verify package"""
\ No newline at end of file
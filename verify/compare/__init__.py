@@ -0,0 +1 @@
+""" Compare module for verify package """
\ No newline at end of file
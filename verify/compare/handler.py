@@ -0,0 +1,81 @@
+""" Handler for compare subcommand on verify """
+
+import verify.merkle as merkle
+import keystores.indexes as indexes
+import verify.compare.validation_logic as logic
+
+from cli.pretty.colors import bold, end, yellow, green, red
+
+def handler(subcommand_flags: list):
+    """
+    Compares the Merkle tree of a key directory with the one of another host.
+        - With another tree file, walks both trees and names the differing key indexes.
+        - With the top node of the other host's tree, names the local keys outside of it, then
+          compares it like the nodes below.
+        - With nodes of the other host's tree, compares them with the local tree and prints
+          the children of the differing nodes, to pass to the other host for the next round.
+    """
+    # Unpack the flags
+    tree, other_tree, top_node, nodes = logic.get_and_validate_params(subcommand_flags)
+
+    if other_tree is not None:
+        compare_with_tree(tree, other_tree)
+    elif top_node:
+        compare_with_top_node(tree, top_node)
+    else:
+        compare_with_nodes(tree, nodes)
+
+    return
+
+def compare_with_tree(tree: list, other_tree: list):
+    """Walks both trees and prints the key index ranges whose keystores differ"""
+    differing, comparisons = merkle.compare_trees(tree, other_tree)
+
+    if not differing:
+        print(f"\n[{green}SUCCESS{end}] The trees match.\n")
+        return
+
+    print(f"\n[{red}MISMATCH{end}] {bold}{len(differing)}{end} keys differ, found in {comparisons} node comparisons:",
+          f"\n\t{yellow}{indexes.format_ranges(indexes.group_indexes(differing), flag_value=True)}{end}",
+          "\n\tKeys missing on one host differ too. Fetch them again with 'secrets get --index-range=<ranges>'.\n")
+
+def compare_with_top_node(tree: list, top_node: tuple):
+    """
+    Starts reconciling with the other host's top node. The other host has no keys outside of
+    it, so the local keys outside of it differ, and the keys under it are compared by rounds.
+    """
+    level, position, _ = top_node
+    low, high = merkle.get_node_range(level, position)
+    outside = sorted(index for index in tree[0] if not low <= index <= high)
+    if outside:
+        print(f"\t[{red}x{end}] Keys only on this host: {yellow}{indexes.format_ranges(indexes.group_indexes(outside), flag_value=True)}{end}")
+
+    compare_with_nodes(tree, [top_node])
+
+def compare_with_nodes(tree: list, nodes: list):
+    """
+    Compares nodes of the other host's tree with the local tree. Every round descends one level
+    below the differing nodes, so reconciling takes O(log n) rounds of two hashes per difference.
+    """
+    differing = []
+    next_nodes = []
+    for level, position, node_hash in nodes:
+        low, high = merkle.get_node_range(level, position)
+        if merkle.get_node(tree, level, position) == node_hash:
+            print(f"\t[{green}✓{end}] Keys {low} to {high} match.")
+        elif level == 0:
+            print(f"\t[{red}x{end}] Key {low} differs.")
+            differing.append(low)
+        else:
+            print(f"\t[{yellow}-{end}] Keys {low} to {high} differ.")
+            next_nodes.extend([merkle.format_node(tree, level - 1, position << 1),
+                               merkle.format_node(tree, level - 1, (position << 1) + 1)])
+
+    if differing:
+        print(f"\n[{red}MISMATCH{end}] Keys that differ: {yellow}{indexes.format_ranges(indexes.group_indexes(sorted(differing)), flag_value=True)}{end}")
+
+    if next_nodes:
+        print("\n[INFO] Run on the other host to continue:",
+              f"\n\t{bold}verify compare --nodes={','.join(next_nodes)}{end}\n")
+    elif not differing:
+        print(f"\n[{green}SUCCESS{end}] The compared nodes match.\n")
@@ -0,0 +1,83 @@
+"""Functions for validation for the compare subcommand"""
+
+import os
+import sys
+
+import verify.merkle as merkle
+
+from cli.pretty.colors import red, end, yellow, bold
+
+def get_and_validate_params(subcommand_flags: list) -> tuple:
+    """
+    Gets and validates the parameters passed via the subcommands.
+    Returns tree, other_tree, top_node, nodes
+        - tree: The local tree, as in merkle.build_tree
+        - other_tree: The tree to compare with, or None
+        - top_node: Tuple (level, position, hash) of the other host's top node, or None
+        - nodes: List of tuples (level, position, hash) of the other host's nodes to compare with
+    """
+    # Set command variables
+    tree_path = merkle.TREE_FILE_NAME
+    other_tree_path = ""
+    top_node = ""
+    nodes = ""
+
+    # Unpack subcommand flags
+    while subcommand_flags:
+
+        # Get only the flags with a value
+        flag_head_to_val = subcommand_flags.pop().split("=")
+        if len(flag_head_to_val) > 1 and flag_head_to_val[1]:
+
+            # Get the flag head
+            flag = flag_head_to_val[0]
+            flag_value = flag_head_to_val[1]
+
+            # Check for flags
+            if flag == "--tree":
+                tree_path = flag_value
+            if flag == "--other-tree":
+                other_tree_path = flag_value
+            if flag == "--top":
+                top_node = flag_value
+            if flag == "--nodes":
+                nodes = flag_value
+
+    # Check there is something to compare with
+    if not any([other_tree_path, top_node, nodes]):
+        print(f"[{red}ERROR{end}] Missing flag {yellow}--other-tree=<value>{end}, {yellow}--top=<value>{end}",
+              f"or {yellow}--nodes=<value>{end}")
+        sys.exit(1)
+
+    # Read the trees
+    tree = read_tree(tree_path)
+    other_tree = read_tree(other_tree_path) if other_tree_path else None
+
+    # Parse the nodes
+    parsed_top_node = parse_nodes("--top", top_node)[0] if top_node else None
+    parsed_nodes = parse_nodes("--nodes", nodes) if nodes else []
+
+    # Else return flags
+    return tree, other_tree, parsed_top_node, parsed_nodes
+
+def parse_nodes(flag_head: str, value: str) -> list:
+    """Parses comma separated nodes, exiting on invalid values"""
+    try:
+        return [merkle.parse_node(node) for node in value.split(",")]
+    except ValueError:
+        print(f"[{red}ERROR{end}] Invalid value '{bold}{value}{end}' for flag '{yellow}{flag_head}{end}'.",
+              "Please enter comma separated <level>:<position>:<hash> nodes, as printed by 'verify'.")
+        sys.exit(1)
+
+def read_tree(path: str) -> list:
+    """Reads a tree file, exiting if it doesn't exist or is invalid"""
+    if not os.path.isfile(path):
+        print(f"[{red}ERROR{end}] The tree file '{bold}{path}{end}' does not exist.",
+              "\n\tIt's written by 'verify hash'.")
+        sys.exit(1)
+
+    try:
+        return merkle.read_tree(path)
+    except ValueError as error:
+        print(f"[{red}ERROR{end}] {error}.")
+        sys.exit(1)
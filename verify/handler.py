@@ -0,0 +1,16 @@
+""" Receives calls from main and routes to appropriate subcommand"""
+
+import verify.hash.handler as hasher
+import verify.compare.handler as comparer
+
+def handler(_, subcommand, subcommand_flags):
+    """
+    Routes the verify subcommands.
+    """
+    # Route
+    if subcommand == "hash":
+        hasher.handler(subcommand_flags)
+    elif subcommand == "compare":
+        comparer.handler(subcommand_flags)
+
+    return
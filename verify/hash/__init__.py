@@ -0,0 +1 @@
+""" Hash module for verify package """
\ No newline at end of file
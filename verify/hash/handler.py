@@ -0,0 +1,65 @@
+""" Handler for hash subcommand on verify """
+
+import os
+import time
+
+import verify.utilities as util
+import verify.merkle as merkle
+import verify.hash.validation_logic as logic
+
+from cli.pretty.colors import bold, end, blue, yellow, green
+
+def handler(subcommand_flags: list):
+    """
+    Hashes a key directory like the verify/*.sh scripts, over a pool of threads.
+        1. Lists the files in the directory and the keystores at its top
+        2. Hashes every file once
+        3. Writes the directory digest and the per key hashes
+        4. Writes the Merkle tree of the keystores
+    """
+    # Unpack the flags
+    key_directory, output_dir, concurrency = logic.get_and_validate_params(subcommand_flags)
+
+    # List the files
+    #? Symlinked keystores are hashed by single-key-hash.sh but skipped by 'find -type f'.
+    directory_files = util.list_directory_files(key_directory)
+    key_files = util.list_key_files(key_directory)
+    print(f"[INFO] Hashing {bold}{yellow}{len(directory_files)}{end} files in {blue}{key_directory}{end}",
+          f"with {concurrency} threads...")
+
+    # Hash every file once
+    start = time.time()
+    digests = util.hash_files(list(dict.fromkeys(directory_files + key_files)), concurrency)
+    print(f"\t[{green}✓{end}] Hashed {len(digests)} files in {round(time.time() - start, 2)}s.")
+
+    # Write the directory digest
+    #? The script saves the 'sha256sum -' output, <hash> -, with the spaces collapsed by echo.
+    directory_digest = util.get_directory_digest({path: digests[path] for path in directory_files})
+    directory_hash_path = os.path.join(output_dir, util.DIRECTORY_HASH_FILE_NAME)
+    with open(directory_hash_path, "w", encoding="utf-8") as f:
+        f.write(f"{directory_digest} -\n")
+        f.close()
+
+    # Write the per key hashes
+    key_hashes_path = os.path.join(output_dir, util.KEY_HASHES_FILE_NAME)
+    with open(key_hashes_path, "w", encoding="utf-8") as f:
+        for line in util.get_key_hash_lines(digests, key_files):
+            f.write(f"{line}\n")
+        f.close()
+
+    # Write the Merkle tree of the keystores
+    entries = merkle.get_key_entries(digests, key_files)
+    tree_path = os.path.join(output_dir, merkle.TREE_FILE_NAME)
+    merkle.write_tree(tree_path, entries)
+    tree = merkle.build_tree(entries)
+    top_level, top_position = merkle.get_top_node(tree)
+
+    print("\nSHA-256 of provided key directory is:")
+    print(f"{yellow}{directory_digest}{end}")
+    print(f"\n[{green}SUCCESS{end}] Saved the directory hash to {green}{directory_hash_path}{end}",
+          f"and the hashes of {len(key_files)} keystores to {green}{key_hashes_path}{end}.")
+    print(f"\n[INFO] Wrote the Merkle tree of {len(entries)} keystores to {blue}{tree_path}{end}. Its top node is:",
+          f"\n\t{yellow}{merkle.format_node(tree, top_level, top_position)}{end}",
+          "\n\tCompare it on another host with 'verify compare --top=<top node>'.\n")
+
+    return
@@ -0,0 +1,59 @@
+"""Functions for validation for the hash subcommand"""
+
+import os
+import sys
+
+from cli.pretty.colors import red, end, yellow, bold
+
+def get_and_validate_params(subcommand_flags: list) -> tuple:
+    """
+    Gets and validates the parameters passed via the subcommands.
+    Returns key_directory, output_dir, concurrency
+    """
+    # Set command variables
+    key_directory = ""
+    output_dir = "."
+    concurrency = "8"
+
+    # Unpack subcommand flags
+    while subcommand_flags:
+
+        # Get only the flags with a value
+        flag_head_to_val = subcommand_flags.pop().split("=")
+        if len(flag_head_to_val) > 1 and flag_head_to_val[1]:
+
+            # Get the flag head
+            flag = flag_head_to_val[0]
+            flag_value = flag_head_to_val[1]
+
+            # Check for flags
+            if flag == "--key-directory":
+                key_directory = flag_value
+            if flag == "--output-dir":
+                output_dir = flag_value
+            if flag == "--concurrency":
+                concurrency = flag_value
+
+    # Check mandatory flags exist
+    if not key_directory:
+        print(f"[{red}ERROR{end}] Missing flag {yellow}--key-directory=<value>{end}")
+        sys.exit(1)
+
+    # Check the key directory exists
+    if not os.path.isdir(key_directory):
+        print(f"[{red}ERROR{end}] The directory '{bold}{key_directory}{end}' does not exist.")
+        sys.exit(1)
+
+    # Check the output directory exists
+    if not os.path.isdir(output_dir):
+        print(f"[{red}ERROR{end}] The output directory '{bold}{output_dir}{end}' does not exist.")
+        sys.exit(1)
+
+    # Check the concurrency is a positive integer
+    if not concurrency.isnumeric() or int(concurrency) < 1:
+        print(f"[{red}ERROR{end}] Invalid value '{bold}{concurrency}{end}' for flag '{yellow}--concurrency{end}'.",
+              "Please enter a positive integer.")
+        sys.exit(1)
+
+    # Else return flags
+    return key_directory, output_dir, int(concurrency)
@@ -0,0 +1,167 @@
+"""Merkle tree of the keystores of a key directory, ordered by key index"""
+
+import re
+import struct
+import hashlib
+
+# Tree file
+TREE_FILE_NAME = "key-merkle-tree.bin"
+TREE_FILE_MAGIC = b"KMT1"
+
+# Tree shape
+#? Key indexes are uint32 (EIP-2334), so every key has a fixed leaf position in a tree of depth 32.
+#? Both hosts place a key at the same leaf, so a missing key doesn't shift the leaves after it.
+TREE_DEPTH = 32
+EMPTY_NODE = bytes(32)
+
+# Node hash prefixes, so a leaf can never collide with an inner node
+LEAF_PREFIX = b"\x00"
+INNER_PREFIX = b"\x01"
+
+# Key index of a keystore file name
+KEY_INDEX_PATTERN = r'keystore-m_12381_3600_(\d+)_0_0-'
+
+def get_key_entries(digests: dict, key_files: list) -> list:
+    """
+    Pairs every keystore with its key index.
+
+    Args:
+        digests: Dict of path to hex SHA256, holding every key file.
+        key_files: List of key file paths from util.list_key_files.
+
+    Returns: A list of tuples (int:key index, bytes:SHA256 of the keystore) sorted by key index.
+        Keystores without a key index in their name are left out.
+    """
+    entries = []
+    for path in key_files:
+        match = re.search(KEY_INDEX_PATTERN, path.split("/")[-1])
+        if match and int(match.group(1)) < 2 ** TREE_DEPTH:
+            entries.append((int(match.group(1)), bytes.fromhex(digests[path])))
+
+    #? Keystores sharing an index are ordered by hash, so the leaf doesn't depend on the file names.
+    return sorted(entries)
+
+def build_tree(entries: list) -> list:
+    """
+    Builds the sparse Merkle tree of the key entries. The leaf of key index i is at position i of
+    level 0 and hashes the index with the SHA256 of its keystores. Every inner node hashes its
+    two children, and subtrees without keys are EMPTY_NODE and aren't stored.
+
+    Args:
+        entries: List of tuples (int:key index, bytes:SHA256 of the keystore) from get_key_entries.
+
+    Returns: A list of TREE_DEPTH + 1 dicts of position to node hash, leaves first.
+    """
+    # Hash the leaves
+    leaf_digests = {}
+    for index, digest in entries:
+        leaf_digests.setdefault(index, []).append(digest)
+    level = {index: hashlib.sha256(LEAF_PREFIX + struct.pack(">I", index) + b"".join(digests)).digest()
+             for index, digests in leaf_digests.items()}
+    tree = [level]
+
+    # Hash every level from the one below
+    for _ in range(TREE_DEPTH):
+        below = level
+        level = {}
+        for position in {position >> 1 for position in below}:
+            left = below.get(position << 1, EMPTY_NODE)
+            right = below.get((position << 1) + 1, EMPTY_NODE)
+            level[position] = hashlib.sha256(INNER_PREFIX + left + right).digest()
+        tree.append(level)
+
+    return tree
+
+def get_node(tree: list, level: int, position: int) -> bytes:
+    """Returns the hash of a node of the tree, EMPTY_NODE if its subtree has no keys"""
+    return tree[level].get(position, EMPTY_NODE)
+
+def get_top_node(tree: list) -> tuple:
+    """
+    Returns the smallest subtree holding every key, where reconciling two trees starts.
+
+    Returns: A tuple int:level, int:position. The root if the tree has no keys.
+    """
+    if not tree[0]:
+        return TREE_DEPTH, 0
+
+    #? The lowest common ancestor of the lowest and highest leaves holds every leaf between them.
+    low, high = min(tree[0]), max(tree[0])
+    level = (low ^ high).bit_length()
+    return level, low >> level
+
+def get_node_range(level: int, position: int) -> tuple:
+    """Returns the tuple int:low, int:high of the key indexes under a node"""
+    return position << level, ((position + 1) << level) - 1
+
+def format_node(tree: list, level: int, position: int) -> str:
+    """Formats a node as <level>:<position>:<hex hash>, as taken by 'verify compare --nodes'"""
+    return f"{level}:{position}:{get_node(tree, level, position).hex()}"
+
+def parse_node(node: str) -> tuple:
+    """
+    Parses a node formatted by format_node.
+
+    Returns: A tuple int:level, int:position, bytes:hash. Raises ValueError on invalid nodes.
+    """
+    level, position, node_hash = node.split(":")
+    level, position, node_hash = int(level), int(position), bytes.fromhex(node_hash)
+    if not 0 <= level <= TREE_DEPTH or not 0 <= position < 2 ** (TREE_DEPTH - level) or len(node_hash) != 32:
+        raise ValueError(f"Invalid node {node}")
+    return level, position, node_hash
+
+def compare_trees(tree: list, other_tree: list) -> tuple:
+    """
+    Walks two trees from the root, only descending into the nodes that differ.
+    Finding d differing keys among n takes O(d log n) node comparisons.
+
+    Returns: A tuple list:sorted key indexes whose leaves differ, int:number of node comparisons.
+    """
+    differing = []
+    comparisons = 0
+    pending = [(TREE_DEPTH, 0)]
+    while pending:
+        level, position = pending.pop()
+        comparisons += 1
+        if get_node(tree, level, position) == get_node(other_tree, level, position):
+            continue
+
+        if level == 0:
+            differing.append(position)
+        else:
+            pending.extend([(level - 1, position << 1), (level - 1, (position << 1) + 1)])
+
+    return sorted(differing), comparisons
+
+def write_tree(path: str, entries: list):
+    """
+    Writes the key entries of a tree to a binary file. The inner nodes are rebuilt on read.
+    Format: magic 'KMT1', uint32 number of entries, then per entry a uint32 key index and the
+    32 byte SHA256 of the keystore, all big endian.
+    """
+    with open(path, "wb") as f:
+        f.write(TREE_FILE_MAGIC + struct.pack(">I", len(entries)))
+        for index, digest in entries:
+            f.write(struct.pack(">I", index) + digest)
+        f.close()
+
+def read_tree(path: str) -> list:
+    """
+    Reads a tree file written by write_tree and rebuilds the tree.
+
+    Returns: The tree, as in build_tree. Raises ValueError on invalid files.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+        f.close()
+
+    if data[:4] != TREE_FILE_MAGIC or len(data) < 8:
+        raise ValueError(f"{path} is not a key Merkle tree file")
+    count = struct.unpack(">I", data[4:8])[0]
+    if len(data) != 8 + count * 36:
+        raise ValueError(f"{path} is truncated")
+
+    entries = [(struct.unpack(">I", data[offset:offset + 4])[0], data[offset + 4:offset + 36])
+               for offset in range(8, len(data), 36)]
+
+    return build_tree(entries)
@@ -0,0 +1,108 @@
+"""Parallel hashing engine of the verify command, compatible with the verify/*.sh scripts"""
+
+import os
+import re
+import hashlib
+import concurrent.futures
+
+# Output files, named as in the bash scripts
+DIRECTORY_HASH_FILE_NAME = "whole-directory-hash.txt"
+KEY_HASHES_FILE_NAME = "single-key-hashes.txt"
+
+# Keystores hashed one by one, as matched by the keystore-m_12381_3600_*.json glob of single-key-hash.sh
+KEY_FILE_PATTERN = r'^keystore-m_12381_3600_.*\.json$'
+
+# Hashing settings
+#? Keystores fit in a single read. Larger files are hashed in chunks of the buffer size.
+READ_BUFFER_SIZE = 1024 * 1024
+#? Files are handed to the pool in batches to keep the pending work bounded on large directories.
+HASH_BATCH_SIZE = 4096
+
+def hash_file(path: str) -> str:
+    """Returns the hex SHA256 of a file, read with unbuffered reads of READ_BUFFER_SIZE bytes"""
+    sha256 = hashlib.sha256()
+    with open(path, "rb", buffering=0) as f:
+        chunk = f.read(READ_BUFFER_SIZE)
+        while chunk:
+            sha256.update(chunk)
+            chunk = f.read(READ_BUFFER_SIZE)
+        f.close()
+
+    return sha256.hexdigest()
+
+def hash_files(paths: list, concurrency: int) -> dict:
+    """
+    Hashes every file over a pool of threads. hashlib and the file reads release the GIL, so
+    the threads hash in parallel.
+
+    Args:
+        paths: List of file paths to hash.
+        concurrency: Number of threads hashing in parallel.
+
+    Returns: A dict of path to hex SHA256.
+    """
+    digests = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for start in range(0, len(paths), HASH_BATCH_SIZE):
+            batch = paths[start:start + HASH_BATCH_SIZE]
+            digests.update(zip(batch, executor.map(hash_file, batch)))
+
+    return digests
+
+def list_directory_files(directory: str) -> list:
+    """
+    Lists the regular files under the directory, recursively, as 'find <directory> -type f' does.
+    Symlinks are neither followed nor listed.
+    """
+    files = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            if os.path.isfile(path) and not os.path.islink(path):
+                files.append(path)
+
+    return files
+
+def list_key_files(directory: str) -> list:
+    """
+    Lists the keystore files at the top of the directory, as the glob of single-key-hash.sh does.
+
+    Returns: A list of paths sorted by file name, in the order of the glob in the C locale.
+    """
+    names = sorted(name for name in os.listdir(directory) if re.match(KEY_FILE_PATTERN, name))
+    return [f"{directory}/{name}" for name in names if os.path.isfile(f"{directory}/{name}")]
+
+def get_sha256sum_line(digest: str, path: str) -> str:
+    """Formats a digest as a line of the 'sha256sum' output, <hash>  <path>"""
+    #? sha256sum escapes backslashes and newlines in the path, and flags the line with a leading backslash.
+    if "\\" in path or "\n" in path:
+        return f"\\{digest}  " + path.replace("\\", "\\\\").replace("\n", "\\n")
+    return f"{digest}  {path}"
+
+def get_directory_digest(digests: dict) -> str:
+    """
+    Computes the directory digest of directory-hash.sh, the SHA256 of the sorted file hashes.
+        find <dir> -type f -exec sha256sum | sort | cut -d' ' -f1 | sha256sum
+
+    Args:
+        digests: Dict of path to hex SHA256 of every file in the directory.
+
+    Returns: The hex SHA256 of the directory.
+    """
+    #? The lines are sorted whole, then cut to their hash. Tied hashes cut to the same line.
+    lines = sorted(get_sha256sum_line(digest, path) for path, digest in digests.items())
+    hashes = "".join(f"{line.split(' ')[0]}\n" for line in lines)
+    return hashlib.sha256(hashes.encode("utf-8")).hexdigest()
+
+def get_key_hash_lines(digests: dict, key_files: list) -> list:
+    """
+    Formats the lines of the per key hash file of single-key-hash.sh, one 'sha256sum' line per
+    keystore, with the first double slash of the line replaced by a single one.
+
+    Args:
+        digests: Dict of path to hex SHA256, holding every key file.
+        key_files: List of key file paths from list_key_files.
+
+    Returns: A list of lines, without line breaks.
+    """
+    return [get_sha256sum_line(digests[path], path).replace("//", "/", 1) for path in key_files]
@@ -1,8 +1,8 @@
 """Utilities for the keys_config subcommand on web3signer command"""
 
-import os
 import sys
-import glob
+
+import keystores.scanner as scanner
 
 from cli.pretty.colors import red, end
     
@@ -15,20 +15,16 @@ def get_keystore_files(key_directory_path: str) -> list:
 
     It exists if it does not find any files.
     """
-    # Set the filename desired format and filter with glob
+    # Scan the directory for keystores, sorted by index
     desired_format = "keystore-m_12381_3600_*_0_0-*.json"
-    matching_files = glob.glob(os.path.join(key_directory_path, desired_format))
+    file_names = [key_file.path for key_file in scanner.scan_keystores(key_directory_path)]
 
     # Verify that there exists at least one keystore matching the format
-    if len(matching_files) < 1:
+    if len(file_names) < 1:
         print(f"\n{red}[ERROR]{end} No keys matching the keystore naming format found.",
               f"\n\tExpected format is {desired_format}. See README.md for more details.")
         sys.exit(1)
 
-    # Get all filenames paths sorted by index
-    #? Sorts by i in /full/path/to/keystore-m_12381_3600_i_0_0-timestamp.json
-    file_names = sorted(matching_files, key=lambda x: int(x.split("_")[-3]))
-    
     return file_names
 
 def get_all_existing_keystore_configurations(config_file: str) -> dict: